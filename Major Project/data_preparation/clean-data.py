@@ -1,25 +1,51 @@
-import re
+import os
+import sys
+import time
+import multiprocessing as mp
+from cleaning import clean_non_devanagari
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # for sharding.py
+from sharding import imap_bounded
 
-def clean_non_devanagari(text):
-    # Remove HTML tags
-    text = re.sub(r'<[^>]+>', '', text)
-    # Remove CSS-like blocks
-    text = re.sub(r'\{[^}]*\}', '', text)
-    # Remove double danda (॥)
-    text = re.sub(r'\u0965', '', text)
-    # Remove non-Devanagari characters except digits and danda
-    allowed_pattern = r'[^\u0900-\u097F\u0966-\u096F\u0964\s]'
-    text = re.sub(allowed_pattern, '', text)
-    # Collapse multiple spaces
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
+def clean_block(lines):
+    # cleans a block of lines in a pool worker, returns the cleaned text of the block
+    # and the (lines in, lines out, bytes in) counts for the throughput report
+    out = []
+    for line in lines:
+        cleaned = clean_non_devanagari(line)
+        if cleaned:  # skip empty lines
+            out.append(cleaned + "\n")
+    return "".join(out), len(lines), len(out), sum(len(line.encode("utf-8")) for line in lines)
+
+def read_blocks(infile, block_bytes):
+    # whole lines, about block_bytes of them per block
+    while True:
+        lines = infile.readlines(block_bytes)
+        if not lines:
+            return
+        yield lines
 
 input_path = "combined_output.txt"
 output_path = "cleaned_text.txt"
+block_bytes = 1 << 22  # about 4MB of text per pool task
+nprocs = max(1, mp.cpu_count() - 1)
+max_pending = 4 * nprocs  # blocks read ahead of the writer
 
-with open(input_path, "r", encoding="utf-8") as infile, \
-     open(output_path, "w", encoding="utf-8") as outfile:
-    for line in infile:
-        cleaned = clean_non_devanagari(line)
-        if cleaned:  # skip empty lines
-            outfile.write(cleaned + "\n")
+if __name__ == '__main__':
+    t0 = time.time()
+    lines_in = lines_out = bytes_in = 0
+    with open(input_path, "r", encoding="utf-8") as infile, \
+         open(output_path, "w", encoding="utf-8") as outfile, \
+         mp.Pool(nprocs) as pool:
+        # the blocks come back in input order, so the output keeps the order of the input. at most
+        # max_pending blocks are read ahead of the writer, pool.imap would read the whole input ahead
+        for i, (text, n_in, n_out, b_in) in enumerate(imap_bounded(pool, clean_block, read_blocks(infile, block_bytes), max_pending)):
+            outfile.write(text)
+            lines_in += n_in
+            lines_out += n_out
+            bytes_in += b_in
+            if i % 50 == 0:
+                dt = time.time() - t0
+                print(f"{lines_in:,} lines | {lines_in / dt:,.0f} lines/s | {bytes_in / dt / 1e6:.1f} MB/s")
+    dt = time.time() - t0
+    print(f"cleaned {lines_in:,} lines ({bytes_in / 1e6:.1f} MB) into {lines_out:,} lines in {dt:.1f}s: "
+          f"{lines_in / dt:,.0f} lines/s, {bytes_in / dt / 1e6:.1f} MB/s")
@@ -0,0 +1,112 @@
+import os
+import re
+import hashlib
+import unicodedata
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# text cleaning, deduplication and block reading shared by the data_preparation scripts,
+# shard-gen-pipeline.py and tokenizer/word_counts.py
+
+# patterns are compiled once, at import, so every pool worker has them ready
+DATELINE = re.compile(r'^.*?।')
+HTML_TAG = re.compile(r'<[^>]+>')
+CSS_BLOCK = re.compile(r'\{[^}]*\}')
+# keep Devanagari (digits and danda included) and whitespace. the double danda (॥, U+0965)
+# is left out of the range, so its removal is folded into the same pass
+NOT_ALLOWED = re.compile(r'[^\u0900-\u0964\u0966-\u097F\s]+')
+
+def clean_text(text):
+    # the dateline stripping of exploring_nepberta.ipynb, applied to the raw 'text' column of the csv
+    text = text.strip()
+    # Remove place name patterns (typically up to first "।")
+    text = DATELINE.sub('', text, 1)  # Remove up to first "।"
+    return text.strip()
+
+def clean_non_devanagari(text):
+    # Remove HTML tags
+    text = HTML_TAG.sub('', text)
+    # Remove CSS-like blocks
+    text = CSS_BLOCK.sub('', text)
+    # Remove double danda (॥) and all non-Devanagari characters except digits and danda
+    text = NOT_ALLOWED.sub('', text)
+    # Collapse multiple spaces (str.split() splits on the same whitespace as \s)
+    return ' '.join(text.split())
+
+def normalize_line(line):
+    # the form two lines are compared in for dedup: NFC, whitespace collapsed
+    return ' '.join(unicodedata.normalize('NFC', line).split())
+
+def line_hashes(lines, bits=64):
+    # hashes of lines for exact deduplication, uint64 for 64 bits, 16-byte strings for 128 bits
+    if bits == 64:
+        return np.array([int.from_bytes(hashlib.blake2b(line.encode('utf-8'), digest_size=8).digest(), 'little')
+                         for line in lines], dtype=np.uint64)
+    assert bits == 128, f"hashes are 64 or 128 bits, not {bits}"
+    return np.array([hashlib.blake2b(line.encode('utf-8'), digest_size=16).digest() for line in lines], dtype='S16')
+
+class SeenHashes:
+    """The set of line hashes seen so far, kept as a few sorted runs (8 or 16 bytes per line).
+
+    New hashes go into a new run, and runs are merged whenever one gets at least as large
+    as the one before it, so there are only O(log n) runs and every hash is merged O(log n) times.
+    With a memory_budget (in bytes), the runs in memory are merged and spilled to a sorted
+    .npy file in spill_dir whenever they outgrow it, and are looked up memory-mapped from there.
+    """
+
+    def __init__(self, memory_budget=None, spill_dir=None):
+        assert memory_budget is None or spill_dir is not None, "a memory budget needs a spill_dir"
+        self.runs = []
+        self.disk_runs = []
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs + self.disk_runs)
+
+    def memory_bytes(self):
+        return sum(run.nbytes for run in self.runs)
+
+    def add(self, hashes):
+        # returns a mask of the hashes that were not seen before, neither in earlier calls
+        # nor earlier in `hashes`, and adds them to the set
+        _, first = np.unique(hashes, return_index=True)
+        new = np.zeros(len(hashes), dtype=bool)
+        new[first] = True
+        for run in self.disk_runs + self.runs:
+            idx = np.searchsorted(run, hashes).clip(max=len(run) - 1)
+            new &= run[idx] != hashes
+        if new.any():
+            self.runs.append(np.sort(hashes[new]))
+            while len(self.runs) > 1 and len(self.runs[-1]) >= len(self.runs[-2]):
+                last = self.runs.pop()
+                self.runs[-1] = np.sort(np.concatenate([self.runs[-1], last]))
+        if self.memory_budget is not None and self.memory_bytes() > self.memory_budget:
+            self.spill()
+        return new
+
+    def spill(self):
+        run = np.sort(np.concatenate(self.runs))
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"seen_{len(self.disk_runs):04d}.npy")
+        np.save(path, run)
+        self.disk_runs.append(np.load(path, mmap_mode='r'))
+        self.runs = []
+
+    def close(self):
+        # remove the spilled runs
+        paths = [run.filename for run in self.disk_runs]
+        self.disk_runs = []
+        for path in paths:
+            os.remove(path)
+
+def read_blocks(infile, block_lines):
+    # blocks of block_lines lines
+    block = []
+    for line in infile:
+        block.append(line)
+        if len(block) == block_lines:
+            yield block
+            block = []
+    if block:
+        yield block
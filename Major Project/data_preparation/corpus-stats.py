@@ -0,0 +1,149 @@
+import os
+import sys
+import mmap
+import json
+import time
+import multiprocessing as mp
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # for sharding.py
+from sharding import line_ranges
+
+# the line, word, char and byte statistics of cleaning_nepberta.ipynb in a single pass: the file is
+# memory-mapped, split into line-aligned ranges for a process pool, and every range is counted
+# chunk by chunk with numpy, so memory does not depend on the number of lines
+
+input_path = "cleaned_text.txt"
+output_path = "corpus_stats.json"
+chunk_bytes = 1 << 23  # bytes counted at once by a worker, its numpy temporaries take a few times this
+max_words = 1024  # the words histogram is exact up to here, longer lines share the last bin
+log_bins = 40  # chars and bytes per line are histogrammed in power of two bins
+nprocs = max(1, mp.cpu_count() - 1)
+
+def empty_stats():
+    return {
+        'lines': 0,
+        'empty_lines': 0,  # lines without a word, as in the notebook
+        'words': 0,
+        'chars': 0,
+        'bytes': 0,
+        'max_words': 0,
+        'max_chars': 0,
+        'max_bytes': 0,
+        'words_hist': np.zeros(max_words + 1, dtype=np.int64),
+        'chars_hist': np.zeros(log_bins, dtype=np.int64),
+        'bytes_hist': np.zeros(log_bins, dtype=np.int64),
+        'devanagari': np.zeros(128, dtype=np.int64),  # U+0900 + i
+    }
+
+def log_bin(x):
+    # bin 0 holds 0, bin k holds [2^(k-1), 2^k)
+    return np.minimum(np.where(x > 0, np.floor(np.log2(np.maximum(x, 1))).astype(np.int64) + 1, 0), log_bins - 1)
+
+def per_line(mask, ends):
+    # the number of True bytes of mask in every line, given the index of every line's last byte
+    # (int32 is enough for the counts of a chunk, int64 would double the largest temporary)
+    cs = np.cumsum(mask, dtype=np.int32)
+    return np.diff(cs[ends], prepend=0)
+
+def count_chunk(buf, stats):
+    if buf[-1] != 0x0A:
+        buf = np.append(buf, np.uint8(0x0A)) # the last line of a file without a trailing newline
+    nl = buf == 0x0A
+    ends = np.flatnonzero(nl)
+    space = nl | (buf == 0x20) | ((buf >= 0x09) & (buf <= 0x0D))
+    char_start = ((buf & 0xC0) != 0x80) & ~nl
+    word_start = ~space & np.concatenate([[True], space[:-1]])
+    line_bytes = np.diff(np.concatenate([[-1], ends])) - 1
+    line_chars = per_line(char_start, ends)
+    line_words = per_line(word_start, ends)
+    stats['lines'] += len(ends)
+    stats['empty_lines'] += int((line_words == 0).sum())
+    stats['words'] += int(line_words.sum())
+    stats['chars'] += int(line_chars.sum())
+    stats['bytes'] += int(line_bytes.sum())
+    stats['max_words'] = max(stats['max_words'], int(line_words.max()))
+    stats['max_chars'] = max(stats['max_chars'], int(line_chars.max()))
+    stats['max_bytes'] = max(stats['max_bytes'], int(line_bytes.max()))
+    stats['words_hist'] += np.bincount(np.minimum(line_words, max_words), minlength=max_words + 1)
+    stats['chars_hist'] += np.bincount(log_bin(line_chars), minlength=log_bins)
+    stats['bytes_hist'] += np.bincount(log_bin(line_bytes), minlength=log_bins)
+    # Devanagari is E0 A4 80-BF (U+0900-U+093F) and E0 A5 80-BF (U+0940-U+097F)
+    lead = np.flatnonzero((buf[:-2] == 0xE0) & ((buf[1:-1] == 0xA4) | (buf[1:-1] == 0xA5)))
+    codepoints = (buf[lead + 1].astype(np.int64) - 0xA4) * 64 + (buf[lead + 2].astype(np.int64) - 0x80)
+    stats['devanagari'] += np.bincount(codepoints, minlength=128)
+
+def count_range(args):
+    # runs in a pool worker: the stats of bytes [start, end) of the file, read chunk by chunk
+    start, end = args
+    stats = empty_stats()
+    with open(input_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = np.frombuffer(mm, dtype=np.uint8)
+        pos = start
+        while pos < end:
+            stop = min(pos + chunk_bytes, end)
+            if stop < end:
+                # extend the chunk to the end of its last line
+                nl = mm.find(b"\n", stop - 1, end)
+                stop = end if nl == -1 else nl + 1
+            count_chunk(data[pos:stop], stats)
+            pos = stop
+        del data # the mmap cannot be closed while a numpy view of it exists
+    return stats
+
+def merge(a, b):
+    for key in a:
+        if key.startswith('max_'):
+            a[key] = max(a[key], b[key])
+        else:
+            a[key] += b[key]
+    return a
+
+def hist_percentile(hist, q):
+    # the smallest bin that holds at least fraction q of the lines
+    return int(np.searchsorted(np.cumsum(hist), q * hist.sum()))
+
+if __name__ == '__main__':
+    t0 = time.time()
+    size = os.path.getsize(input_path)
+    ranges = line_ranges(input_path, nprocs * 4) if size > 0 else []
+    stats = empty_stats()
+    with mp.Pool(nprocs) as pool:
+        for part in pool.imap_unordered(count_range, ranges):
+            merge(stats, part)
+    dt = time.time() - t0
+
+    lines = max(stats['lines'], 1)
+    nonzero_bins = lambda hist: {f"[{2 ** (k - 1) if k else 0}, {2 ** k if k else 1})": int(c) for k, c in enumerate(hist) if c}
+    devanagari = {chr(0x900 + i): int(c) for i, c in sorted(enumerate(stats['devanagari']), key=lambda x: -x[1]) if c}
+    report = {
+        'input': input_path,
+        'lines': stats['lines'],
+        'empty_lines': stats['empty_lines'],
+        'words': stats['words'],
+        'chars': stats['chars'],
+        'bytes': stats['bytes'],
+        'avg_words_per_line': stats['words'] / lines,
+        'avg_chars_per_line': stats['chars'] / lines,
+        'avg_bytes_per_line': stats['bytes'] / lines,
+        'min_words_per_line': int(np.flatnonzero(stats['words_hist'])[0]) if stats['lines'] else 0,
+        'max_words_per_line': stats['max_words'],
+        'max_chars_per_line': stats['max_chars'],
+        'max_bytes_per_line': stats['max_bytes'],
+        'words_per_line_percentiles': {f"p{q}": hist_percentile(stats['words_hist'], q / 100) for q in (50, 90, 99)},
+        'words_per_line_hist': {str(k) if k < max_words else f"{max_words}+": int(c) for k, c in enumerate(stats['words_hist']) if c},
+        'chars_per_line_hist': nonzero_bins(stats['chars_hist']),
+        'bytes_per_line_hist': nonzero_bins(stats['bytes_hist']),
+        'devanagari_chars': int(stats['devanagari'].sum()),
+        'devanagari_codepoints': devanagari,
+        'seconds': dt,
+    }
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print("=" * 40)
+    print(f"Total lines: {report['lines']:,} ({report['empty_lines']:,} empty)")
+    print(f"Total words: {report['words']:,}")
+    print(f"Total chars: {report['chars']:,} ({report['devanagari_chars']:,} Devanagari)")
+    print(f"Total bytes: {report['bytes']:,}")
+    print(f"Average words per line: {report['avg_words_per_line']:.2f}, max {report['max_words_per_line']:,}")
+    print(f"Max line length: {report['max_chars_per_line']:,} chars")
+    print(f"{size / 1e6:.1f} MB in {dt:.1f}s ({size / 1e6 / max(dt, 1e-9):.1f} MB/s), stats saved to {output_path}")
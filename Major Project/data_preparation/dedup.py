@@ -0,0 +1,54 @@
+import json
+import time
+from cleaning import normalize_line, line_hashes, SeenHashes, read_blocks
+
+# streaming exact deduplication of corpus lines: every line is hashed in its normalized form
+# (NFC, whitespace collapsed) and written out only the first time its hash is seen. the seen
+# hashes stay in memory up to memory_budget, beyond that they are spilled to sorted runs on disk
+
+input_path = "cleaned_text.txt"
+output_path = "deduped_text.txt"
+report_path = "dedup_report.json"
+hash_bits = 64  # 64 or 128. with 64 bits the chance that any two different lines collide is ~3e-4 for 10^8 lines
+memory_budget = 1 << 30  # bytes of hashes kept in memory before spilling to disk
+spill_dir = "dedup_runs"
+block_lines = 1 << 16  # lines hashed and looked up at once
+
+if __name__ == '__main__':
+    t0 = time.time()
+    seen = SeenHashes(memory_budget, spill_dir)
+    lines_in = lines_out = bytes_in = bytes_out = 0
+    with open(input_path, "rb") as infile, open(output_path, "wb") as outfile:
+        for i, block in enumerate(read_blocks(infile, block_lines)):
+            keep = seen.add(line_hashes([normalize_line(line.decode('utf-8')) for line in block], hash_bits))
+            kept = [line for line, k in zip(block, keep) if k]
+            outfile.writelines(kept)
+            lines_in += len(block)
+            lines_out += len(kept)
+            bytes_in += sum(len(line) for line in block)
+            bytes_out += sum(len(line) for line in kept)
+            if i % 20 == 0:
+                dt = time.time() - t0
+                print(f"{lines_in:,} lines | {lines_in - lines_out:,} duplicates | {lines_in / dt:,.0f} lines/s | "
+                      f"{bytes_in / dt / 1e6:.1f} MB/s")
+    spilled = len(seen.disk_runs)
+    seen.close()
+
+    report = {
+        'input': input_path,
+        'output': output_path,
+        'hash_bits': hash_bits,
+        'lines_in': lines_in,
+        'lines_out': lines_out,
+        'lines_removed': lines_in - lines_out,
+        'bytes_in': bytes_in,
+        'bytes_out': bytes_out,
+        'bytes_removed': bytes_in - bytes_out,
+        'removed_fraction': (bytes_in - bytes_out) / max(bytes_in, 1),
+        'spilled_runs': spilled,
+        'seconds': time.time() - t0,
+    }
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"removed {report['lines_removed']:,} of {lines_in:,} lines ({report['bytes_removed'] / 1e6:.1f} of "
+          f"{bytes_in / 1e6:.1f} MB, {100 * report['removed_fraction']:.1f}%), report saved to {report_path}")
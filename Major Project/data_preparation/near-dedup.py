@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import sys
+import zlib
+import multiprocessing as mp
+import numpy as np
+from cleaning import read_blocks
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # for sharding.py
+from sharding import imap_bounded
+
+# near-duplicate removal with MinHash-LSH, for syndicated stories and other lines that dedup.py
+# misses because they differ in a few words. three passes over the corpus:
+#   1. every line gets a MinHash signature of its word (or char) n-grams, computed with numpy
+#      over whole blocks of lines in a process pool, and appended to a signature file on disk
+#   2. every LSH band (rows consecutive signature values) is hashed and sorted in a pool worker,
+#      lines that share a band bucket and whose signatures agree on >= threshold of their values
+#      are linked, and the links are merged into clusters
+#   3. the earliest line of every cluster is kept, the rest is dropped
+
+input_path = "deduped_text.txt"
+output_path = "near_deduped_text.txt"
+report_path = "near_dedup_report.json"
+work_dir = "near_dedup"  # the signature file lives here, num_perm * 4 bytes per line
+shingle = 'word'  # 'word' or 'char' n-grams
+ngram = 5  # words (or characters) per shingle, shorter lines are a single shingle
+num_perm = 128  # hash functions per signature
+bands = 16  # num_perm = bands * rows. a pair becomes a candidate if all rows of one band agree
+threshold = 0.8  # candidates with a lower estimated jaccard similarity are not merged
+seed = 1337
+block_lines = 4096  # lines per signature task
+nprocs = max(1, mp.cpu_count() - 1)
+max_pending = 4 * nprocs  # blocks read ahead of the signature writer
+
+rows = num_perm // bands
+assert rows * bands == num_perm, "num_perm has to be a multiple of bands"
+EMPTY = np.uint32(0xFFFFFFFF)  # the signature of a line without shingles, such lines are never merged
+rng = np.random.default_rng(seed)
+# multiply-shift hash functions (a * x + b) >> 32 of a 32-bit shingle hash x, a odd
+PERM_A = rng.integers(0, 2**63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+PERM_B = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+BAND_MULT = rng.integers(0, 2**63, rows, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+NGRAM_PRIME = np.uint64(0x100000001B3)
+MIX = np.uint64(0x9E3779B97F4A7C15)
+SHINGLE_CHUNK = 1 << 14  # shingles hashed at once, num_perm * 8 bytes each
+
+def block_ids(lines):
+    # one uint64 id per word (crc32) or character (code point), and the number of ids of every line
+    lines = [line.decode('utf-8') for line in lines]
+    if shingle == 'word':
+        words = [line.split() for line in lines]
+        ids = np.array([zlib.crc32(w.encode('utf-8')) for ws in words for w in ws], dtype=np.uint64)
+        counts = np.array([len(ws) for ws in words], dtype=np.int64)
+    else:
+        lines = [line.strip() for line in lines]
+        ids = np.frombuffer(''.join(lines).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        counts = np.array([len(line) for line in lines], dtype=np.int64)
+    return ids, counts
+
+def signatures(lines):
+    # MinHash signatures (len(lines), num_perm) of a block of lines, every step vectorized over the block
+    ids, counts = block_ids(lines)
+    sig = np.full((len(lines), num_perm), EMPTY, dtype=np.uint32)
+    if len(ids) == 0:
+        return sig
+    starts = np.cumsum(counts) - counts
+    line_of = np.repeat(np.arange(len(lines)), counts)
+    ends = (starts + counts)[line_of]
+    pos = np.arange(len(ids))
+    # polynomial hash of the n ids from every position, not reaching past the end of its line
+    h = np.zeros(len(ids), dtype=np.uint64)
+    for k in range(ngram):
+        idx = pos + k
+        inside = idx < ends
+        h = np.where(inside, h * NGRAM_PRIME + ids[np.minimum(idx, len(ids) - 1)], h)
+    # full n-grams, plus the whole line for lines shorter than n
+    valid = (pos + ngram <= ends) | ((pos == starts[line_of]) & (counts[line_of] < ngram))
+    x = (h[valid] * MIX) >> np.uint64(32)
+    line_of = line_of[valid]
+    for i in range(0, len(x), SHINGLE_CHUNK):
+        xc, lc = x[i:i + SHINGLE_CHUNK], line_of[i:i + SHINGLE_CHUNK]
+        hv = ((PERM_A[:, None] * xc[None, :] + PERM_B[:, None]) >> np.uint64(32)).astype(np.uint32)
+        # min over the shingles of each line in this chunk, then into the signatures of those lines
+        seg = np.flatnonzero(np.diff(lc, prepend=-1))
+        np.minimum.at(sig, lc[seg], np.minimum.reduceat(hv, seg, axis=1).T)
+    return sig
+
+def open_signatures(num_lines):
+    return np.memmap(os.path.join(work_dir, "signatures.u32"), dtype=np.uint32, mode='r', shape=(num_lines, num_perm))
+
+def band_links(args):
+    # runs in a pool worker: lines whose band b agrees are linked to the earliest line of their
+    # bucket, if the full signatures estimate a jaccard similarity of at least threshold
+    b, num_lines = args
+    sig = open_signatures(num_lines)
+    h = np.empty(num_lines, dtype=np.uint64)
+    valid = np.empty(num_lines, dtype=bool)
+    for i in range(0, num_lines, 1 << 20):
+        band = sig[i:i + (1 << 20), b * rows:(b + 1) * rows].astype(np.uint64)
+        h[i:i + len(band)] = (band * BAND_MULT).sum(axis=1)
+        valid[i:i + len(band)] = band[:, 0] != EMPTY
+    idx = np.flatnonzero(valid)
+    order = np.argsort(h[idx], kind='stable') # stable, so every bucket lists its lines in corpus order
+    h, idx = h[idx][order], idx[order]
+    is_first = np.concatenate([[True], h[1:] != h[:-1]])
+    first = idx[np.maximum.accumulate(np.where(is_first, np.arange(len(idx)), 0))]
+    u, v = idx[~is_first], first[~is_first]
+    candidates = len(u)
+    # verify the candidates on their full signatures
+    keep = np.zeros(len(u), dtype=bool)
+    for i in range(0, len(u), 1 << 16):
+        keep[i:i + (1 << 16)] = (sig[u[i:i + (1 << 16)]] == sig[v[i:i + (1 << 16)]]).mean(axis=1) >= threshold
+    return u[keep], v[keep], candidates
+
+def clusters(num_lines, u, v):
+    # connected components of the links, every line labelled with the earliest line of its cluster
+    labels = np.arange(num_lines)
+    while True:
+        m = np.minimum(labels[u], labels[v])
+        new = labels.copy()
+        np.minimum.at(new, u, m)
+        np.minimum.at(new, v, m)
+        new = new[new] # pointer jumping
+        if (new == labels).all():
+            return labels
+        labels = new
+
+if __name__ == '__main__':
+    t0 = time.time()
+    os.makedirs(work_dir, exist_ok=True)
+
+    # pass 1: signatures
+    num_lines = 0
+    with open(input_path, "rb") as infile, \
+         open(os.path.join(work_dir, "signatures.u32"), "wb") as sigfile, \
+         mp.Pool(nprocs) as pool:
+        for i, sig in enumerate(imap_bounded(pool, signatures, read_blocks(infile, block_lines), max_pending)):
+            sig.tofile(sigfile)
+            num_lines += len(sig)
+            if i % 50 == 0:
+                print(f"signatures: {num_lines:,} lines | {num_lines / (time.time() - t0):,.0f} lines/s")
+    t1 = time.time()
+    print(f"signatures of {num_lines:,} lines in {t1 - t0:.1f}s")
+
+    # pass 2: LSH bands, one pool task per band
+    with mp.Pool(min(nprocs, bands)) as pool:
+        links = pool.map(band_links, [(b, num_lines) for b in range(bands)])
+    u = np.concatenate([l[0] for l in links])
+    v = np.concatenate([l[1] for l in links])
+    candidates = sum(l[2] for l in links)
+    labels = clusters(num_lines, u, v)
+    keep = labels == np.arange(num_lines)
+    cluster_sizes = np.bincount(labels, minlength=num_lines)
+    t2 = time.time()
+    print(f"{candidates:,} candidate pairs, {len(u):,} verified, in {t2 - t1:.1f}s")
+
+    # pass 3: keep the first line of every cluster
+    bytes_in = bytes_out = 0
+    with open(input_path, "rb") as infile, open(output_path, "wb") as outfile:
+        for line, k in zip(infile, keep):
+            bytes_in += len(line)
+            if k:
+                outfile.write(line)
+                bytes_out += len(line)
+
+    report = {
+        'input': input_path,
+        'output': output_path,
+        'shingle': shingle,
+        'ngram': ngram,
+        'num_perm': num_perm,
+        'bands': bands,
+        'threshold': threshold,
+        'lines_in': num_lines,
+        'lines_out': int(keep.sum()),
+        'lines_removed': int(num_lines - keep.sum()),
+        'bytes_in': bytes_in,
+        'bytes_out': bytes_out,
+        'bytes_removed': bytes_in - bytes_out,
+        'clusters': int((cluster_sizes > 1).sum()),
+        'largest_cluster': int(cluster_sizes.max()) if num_lines else 0,
+        'candidate_pairs': int(candidates),
+        'verified_pairs': int(len(u)),
+        'seconds': time.time() - t0,
+    }
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"removed {report['lines_removed']:,} of {num_lines:,} lines in {report['clusters']:,} clusters "
+          f"({report['bytes_removed'] / 1e6:.1f} of {bytes_in / 1e6:.1f} MB), report saved to {report_path}")
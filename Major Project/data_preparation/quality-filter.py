@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import time
+import multiprocessing as mp
+import numpy as np
+from quality import THRESHOLDS, quality_mask
+from cleaning import read_blocks
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # for sharding.py
+from sharding import imap_bounded
+
+# drops low quality lines (fragments, digit-only lines, mangled or repetitive text) before they
+# are tokenized, see quality.py for the rules. the report attributes every dropped line to the
+# first rule it fails, so the lines, bytes and tokens each rule saves add up to what was dropped
+
+input_path = "deduped_text.txt"
+output_path = "filtered_text.txt"
+report_path = "quality_report.json"
+thresholds = dict(THRESHOLDS)  # e.g. dict(THRESHOLDS, min_words=5)
+tokenizer_model = None  # a SentencePiece .model to count the tokens each rule saves, None to skip
+block_lines = 1 << 14  # lines scored at once
+nprocs = max(1, mp.cpu_count() - 1)
+max_pending = 4 * nprocs  # blocks read ahead of the writer
+
+sp = None
+if tokenizer_model is not None:
+    import sentencepiece as spm
+    sp = spm.SentencePieceProcessor()
+    sp.load(tokenizer_model)
+
+def filter_block(lines):
+    # runs in a pool worker: the kept lines of the block, and the per-rule counts of what was dropped
+    keep, features, failures = quality_mask(lines, thresholds)
+    tokens = np.zeros(len(lines), dtype=np.int64)
+    if sp is not None:
+        tokens = np.array([len(ids) for ids in sp.encode([line.decode('utf-8').strip() for line in lines])], dtype=np.int64)
+    failed = np.stack(list(failures.values()))
+    first = np.where(keep, -1, failed.argmax(axis=0)) # the first rule every dropped line fails
+    stats = {'lines': len(lines), 'bytes': int(features['bytes'].sum()), 'tokens': int(tokens.sum()), 'rules': {}}
+    for r, rule in enumerate(failures):
+        dropped = first == r
+        stats['rules'][rule] = {
+            'failed': int(failed[r].sum()),
+            'dropped_lines': int(dropped.sum()),
+            'dropped_bytes': int(features['bytes'][dropped].sum()),
+            'dropped_words': int(features['words'][dropped].sum()),
+            'dropped_tokens': int(tokens[dropped].sum()),
+        }
+    return b"".join(line for line, k in zip(lines, keep) if k), stats
+
+if __name__ == '__main__':
+    t0 = time.time()
+    total = {'lines': 0, 'bytes': 0, 'tokens': 0}
+    rules = {}
+    with open(input_path, "rb") as infile, open(output_path, "wb") as outfile, mp.Pool(nprocs) as pool:
+        for i, (kept, stats) in enumerate(imap_bounded(pool, filter_block, read_blocks(infile, block_lines), max_pending)):
+            outfile.write(kept)
+            for key in total:
+                total[key] += stats[key]
+            for rule, counts in stats['rules'].items():
+                rules.setdefault(rule, dict.fromkeys(counts, 0))
+                for key, value in counts.items():
+                    rules[rule][key] += value
+            if i % 20 == 0:
+                dt = time.time() - t0
+                print(f"{total['lines']:,} lines | {total['lines'] / dt:,.0f} lines/s | {total['bytes'] / dt / 1e6:.1f} MB/s")
+
+    dropped = {key: sum(r[f'dropped_{key}'] for r in rules.values()) for key in total}
+    report = {
+        'input': input_path,
+        'output': output_path,
+        'thresholds': thresholds,
+        'tokenizer': tokenizer_model,
+        'lines_in': total['lines'],
+        'bytes_in': total['bytes'],
+        'tokens_in': total['tokens'] if sp is not None else None,
+        'lines_dropped': dropped['lines'],
+        'bytes_dropped': dropped['bytes'],
+        'tokens_dropped': dropped['tokens'] if sp is not None else None,
+        'rules': rules,
+        'seconds': time.time() - t0,
+    }
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"dropped {dropped['lines']:,} of {total['lines']:,} lines ({dropped['bytes'] / 1e6:.1f} of {total['bytes'] / 1e6:.1f} MB)")
+    for rule, counts in rules.items():
+        saved = f", {counts['dropped_tokens']:,} tokens" if sp is not None else ""
+        print(f"  {rule:>16}: {counts['dropped_lines']:,} lines dropped ({counts['failed']:,} fail it){saved}")
+    print(f"report saved to {report_path}")
@@ -0,0 +1,103 @@
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# line quality scores, shared by quality-filter.py and shard-gen-pipeline.py
+#
+# every score is computed on the UTF-8 bytes of a whole block of lines at once: Devanagari
+# (U+0900-U+097F) is the 3-byte sequences E0 A4 xx and E0 A5 xx, danda and double danda are
+# E0 A5 A4/A5 and the Devanagari digits E0 A5 A6-AF, so no line is ever decoded
+
+# a line is dropped if it fails any of these. the rules are checked (and drops attributed) in this order
+THRESHOLDS = {
+    'min_words': 3,  # fragments shorter than this
+    'max_words': None,  # None for no upper limit
+    'min_devanagari_ratio': 0.8,  # Devanagari characters per non-space character
+    'max_digit_ratio': 0.3,  # digits (Devanagari or ASCII) per non-space character
+    'max_punctuation_ratio': 0.5,  # dandas and ASCII punctuation per word
+    'max_repetition': 0.5,  # words that repeat an earlier word of the same line, per word
+}
+
+WORD_MULT = np.uint64(0x100000001B3)
+
+def line_features(lines):
+    # per-line counts of a block of lines (str or bytes), as int64 arrays
+    lines = [line.encode('utf-8') if isinstance(line, str) else line for line in lines]
+    lines = [line.rstrip(b'\r\n') for line in lines]
+    n = len(lines)
+    buf = np.frombuffer(b''.join(line + b'\n' for line in lines), dtype=np.uint8)  # empty for an empty block
+    nl = buf == 0x0A
+    line_of = np.cumsum(nl) - nl # the newline ending a line belongs to it
+    def count(mask):
+        return np.bincount(line_of[mask], minlength=n)
+    padded = np.append(buf, np.zeros(2, dtype=np.uint8)) # the bytes after the end are zeros, even for a single b'\n'
+    nxt, nxt2 = padded[1:-1], padded[2:]
+    space = nl | (buf == 0x20) | ((buf >= 0x09) & (buf <= 0x0D))
+    char_start = (buf & 0xC0) != 0x80
+    devanagari = (buf == 0xE0) & ((nxt == 0xA4) | (nxt == 0xA5))
+    danda = (buf == 0xE0) & (nxt == 0xA5) & ((nxt2 == 0xA4) | (nxt2 == 0xA5))
+    deva_digit = (buf == 0xE0) & (nxt == 0xA5) & (nxt2 >= 0xA6) & (nxt2 <= 0xAF)
+    ascii_digit = (buf >= 0x30) & (buf <= 0x39)
+    ascii_punct = ((buf >= 0x21) & (buf <= 0x2F)) | ((buf >= 0x3A) & (buf <= 0x40)) | \
+                  ((buf >= 0x5B) & (buf <= 0x60)) | ((buf >= 0x7B) & (buf <= 0x7E))
+    word_start = ~space & np.concatenate([[True], space])[:-1]
+
+    # repetition: hash every word from its bytes, then count the words equal to an earlier word of their line
+    starts = np.flatnonzero(word_start)
+    repeated = np.zeros(n, dtype=np.int64)
+    if len(starts) > 0:
+        in_word = np.flatnonzero(~space)
+        word_of = np.cumsum(word_start)[in_word] - 1
+        offset = in_word - starts[word_of]
+        powers = np.cumprod(np.full(int(offset.max()) + 1, WORD_MULT, dtype=np.uint64))
+        hashes = np.add.reduceat((buf[in_word].astype(np.uint64) + np.uint64(1)) * powers[offset],
+                                 np.flatnonzero(offset == 0))
+        word_line = line_of[starts]
+        order = np.lexsort((hashes, word_line))
+        hashes, word_line = hashes[order], word_line[order]
+        dup = (word_line[1:] == word_line[:-1]) & (hashes[1:] == hashes[:-1])
+        repeated = np.bincount(word_line[1:][dup], minlength=n)
+
+    return {
+        'bytes': np.array([len(line) for line in lines], dtype=np.int64),
+        'chars': count(char_start & ~nl),
+        'nonspace': count(char_start & ~space),
+        'words': count(word_start),
+        'devanagari': count(devanagari),
+        'digits': count(deva_digit | ascii_digit),
+        'punctuation': count(danda | ascii_punct),
+        'repeated_words': repeated,
+    }
+
+def rule_failures(features, thresholds=THRESHOLDS):
+    # one boolean array per rule, True where a line fails it
+    t = dict(THRESHOLDS, **thresholds)
+    words = features['words']
+    nonspace = np.maximum(features['nonspace'], 1)
+    per_word = np.maximum(words, 1)
+    return {
+        'min_words': words < t['min_words'],
+        'max_words': words > t['max_words'] if t['max_words'] is not None else np.zeros(len(words), dtype=bool),
+        'devanagari_ratio': features['devanagari'] / nonspace < t['min_devanagari_ratio'],
+        'digit_ratio': features['digits'] / nonspace > t['max_digit_ratio'],
+        'punctuation': features['punctuation'] / per_word > t['max_punctuation_ratio'],
+        'repetition': features['repeated_words'] / per_word > t['max_repetition'],
+    }
+
+def quality_mask(lines, thresholds=THRESHOLDS):
+    # True for the lines that pass every rule, and the features and failures behind it
+    features = line_features(lines)
+    failures = rule_failures(features, thresholds)
+    keep = np.ones(len(lines), dtype=bool)
+    for failed in failures.values():
+        keep &= ~failed
+    return keep, features, failures
+
+if __name__ == '__main__':
+    # checks of the edge cases: blocks shorter than the two bytes nxt2 looks ahead
+    keep, features, _ = quality_mask([])
+    assert len(keep) == 0 and all(len(v) == 0 for v in features.values())
+    keep, features, _ = quality_mask([""])
+    assert list(keep) == [False] and all(list(v) == [0] for v in features.values())
+    keep, features, _ = quality_mask(["क ख ग", ""])
+    assert list(keep) == [True, False] and list(features['devanagari']) == [3, 0]
+    print("ok")
@@ -1,22 +1,79 @@
-def split_file_into_parts(filename, num_parts=6):
-    with open(filename, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # for sharding.py
+from sharding import line_ranges, chunk_ranges
 
-    total_lines = len(lines)
-    part_size = total_lines // num_parts
+# splits a text file into parts without ever holding more than one copy buffer in memory:
+# part boundaries are found by seeking to approximate byte offsets (or by counting newlines
+# in large reads) and snapping to the next line, then every part is a plain byte-range copy
 
-    for i in range(num_parts):
-        start = i * part_size
-        # Last part takes the remainder
-        end = (i + 1) * part_size if i < num_parts - 1 else total_lines
+BUFFER_SIZE = 1 << 24  # 16MB reads and writes
 
-        part_lines = lines[start:end]
-        part_filename = f"{filename}_part{i+1}.txt"
+def ranges_by_lines(filename, part_lines):
+    # parts of exactly part_lines lines each (the last part takes the remainder). this needs
+    # one pass over the file, but only counts newlines in large buffers
+    bounds = [0]
+    pos = 0
+    lines_in_part = 0
+    with open(filename, 'rb') as f:
+        while True:
+            buf = f.read(BUFFER_SIZE)
+            if not buf:
+                break
+            start = 0
+            while True:
+                n = buf.count(b"\n", start)
+                if lines_in_part + n < part_lines:
+                    lines_in_part += n
+                    break
+                # the part ends inside this buffer, find its last newline
+                for _ in range(part_lines - lines_in_part):
+                    start = buf.index(b"\n", start) + 1
+                bounds.append(pos + start)
+                lines_in_part = 0
+            pos += len(buf)
+    if bounds[-1] < pos:
+        bounds.append(pos)
+    return list(zip(bounds, bounds[1:]))
 
-        with open(part_filename, 'w', encoding='utf-8') as part_file:
-            part_file.writelines(part_lines)
+def copy_range(filename, part_filename, start, end):
+    # stream bytes [start, end) of filename into part_filename
+    with open(filename, 'rb') as src, open(part_filename, 'wb') as dst:
+        src.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            buf = src.read(min(BUFFER_SIZE, remaining))
+            if not buf:
+                break
+            dst.write(buf)
+            remaining -= len(buf)
+    return part_filename
 
-        print(f"Written {len(part_lines)} lines to {part_filename}")
+def split_file(filename, num_parts=None, part_bytes=None, part_lines=None, num_threads=4):
+    # exactly one of num_parts, part_bytes and part_lines picks how the file is split.
+    # the parts are copied by num_threads threads at once (file i/o releases the GIL)
+    assert sum(x is not None for x in (num_parts, part_bytes, part_lines)) == 1, "give one of num_parts, part_bytes, part_lines"
+    t0 = time.time()
+    if num_parts is not None:
+        ranges = line_ranges(filename, num_parts)
+    elif part_bytes is not None:
+        ranges = chunk_ranges(filename, part_bytes)
+    else:
+        ranges = ranges_by_lines(filename, part_lines)
+    with ThreadPoolExecutor(max(1, num_threads)) as executor:
+        futures = [executor.submit(copy_range, filename, f"{filename}_part{i+1}.txt", start, end)
+                   for i, (start, end) in enumerate(ranges)]
+        for future, (start, end) in zip(futures, ranges):
+            print(f"Written {(end - start) / 1e6:.1f} MB to {future.result()}")
+    total = sum(end - start for start, end in ranges)
+    dt = time.time() - t0
+    print(f"split {total / 1e6:.1f} MB into {len(ranges)} parts in {dt:.1f}s ({total / 1e6 / max(dt, 1e-9):.1f} MB/s)")
+    return ranges
 
-# Example usage
-split_file_into_parts("nepberta_text.txt", num_parts=6)
+if __name__ == '__main__':
+    # Example usage
+    split_file("nepberta_text.txt", num_parts=6)
+    # split_file("nepberta_text.txt", part_bytes=256 * 1024 * 1024)
+    # split_file("nepberta_text.txt", part_lines=1_000_000)
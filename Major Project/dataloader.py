@@ -0,0 +1,383 @@
+import os
+import queue
+import threading
+import numpy as np
+import torch
+from shard_format import SHARD_EXT, open_shard, read_shard, check_shard
+
+# -----------------------------------------------------------------------------
+# shard loading shared by all the traingpt-*.py scripts
+
+def load_tokens(filename):
+    if filename.endswith(SHARD_EXT):
+        npt = read_shard(filename)
+    else:
+        npt = np.load(filename) # legacy headerless .npy shard
+    npt = npt.astype(np.int32) # added after video
+    ptt = torch.tensor(npt, dtype=torch.long)
+    return ptt
+
+def open_tokens(filename):
+    # memory-map the shard instead of reading it. nothing is copied off disk here,
+    # the OS pages in only the bytes that a later slice actually touches, so
+    # switching shards is O(1) and resident memory does not grow with shard size.
+    # a compressed shard only decompresses the chunks a slice overlaps
+    if filename.endswith(SHARD_EXT):
+        return open_shard(filename)
+    return np.load(filename, mmap_mode='r') # legacy headerless .npy shard
+
+def widen(buf):
+    # copy a (small) uint16/uint32 slice of a memory-mapped shard into an int64 tensor
+    return torch.from_numpy(buf.astype(np.int64))
+
+def list_shards(data_root, split, master_process=True, vocab_size=None, model_hash=None, min_tokens=None):
+    assert split in {'train', 'val'}
+    # get the shard filenames
+    shards = os.listdir(data_root)
+    shards = [s for s in shards if split in s and s.endswith((SHARD_EXT, '.npy'))]
+    shards = sorted(shards)
+    shards = [os.path.join(data_root, s) for s in shards]
+    assert len(shards) > 0, f"no shards found for split {split}"
+    if min_tokens is not None:
+        # the partial last shard of every parallel or incremental shard-gen range can be too small
+        # for a single batch, and a loader rolling into it could not fill one. opening a shard only reads its header
+        small = [s for s in shards if len(open_tokens(s)) < min_tokens]
+        shards = [s for s in shards if s not in small]
+        assert len(shards) > 0, f"every shard of split {split} is smaller than a batch of {min_tokens:,} tokens"
+        if small and master_process:
+            print(f"skipping {len(small)} shards of split {split} with fewer than {min_tokens:,} tokens")
+    if master_process:
+        print(f"found {len(shards)} shards for split {split}")
+    # shards with a header can be checked against the model before we train on them
+    if vocab_size is not None:
+        for shard in shards:
+            if shard.endswith(SHARD_EXT):
+                check_shard(shard, vocab_size, model_hash)
+    return shards
+
+def stage_batches(loader, steps, device):
+    # read `steps` batches from the start of the loader once and keep them stacked as
+    # (steps, B, T) tensors on `device` (pinned, when staged on the host of a CUDA machine),
+    # so a fixed evaluation set is never read back from disk
+    loader.reset()
+    xs, ys = zip(*(loader.next_batch() for _ in range(steps)))
+    x, y = torch.stack(xs), torch.stack(ys)
+    if device == "cpu" and torch.cuda.is_available():
+        return x.pin_memory(), y.pin_memory()
+    return x.to(device), y.to(device)
+
+def document_ids(x, eot):
+    # shard-gen puts an EOT token at the start of every document, so a running count of EOTs
+    # numbers the documents of each row, and the distance to the last EOT is the position
+    # of a token within its document. x is (B, T), both results are (B, T)
+    is_start = x == eot
+    doc_ids = is_start.cumsum(dim=1)
+    t = torch.arange(x.size(1), device=x.device).expand_as(x)
+    start = torch.where(is_start, t, torch.zeros_like(t)).cummax(dim=1).values
+    pos = t - start
+    return doc_ids, pos
+
+class DataLoaderLite:
+    def __init__(self, B, T, process_rank, num_processes, split, data_root, use_mmap=False, master_process=True,
+                 vocab_size=None, model_hash=None):
+        self.B = B
+        self.T = T
+        self.process_rank = process_rank
+        self.num_processes = num_processes
+        self.use_mmap = use_mmap
+        self.shards = list_shards(data_root, split, master_process, vocab_size, model_hash,
+                                  min_tokens=B * T * num_processes + 1)
+        self.reset()
+
+    def load_shard(self, index):
+        if self.use_mmap:
+            return open_tokens(self.shards[index])
+        return load_tokens(self.shards[index])
+
+    def reset(self):
+        # state, init at shard zero
+        self.current_shard = 0
+        self.tokens = self.load_shard(self.current_shard)
+        self.current_position = self.B * self.T * self.process_rank
+
+    def state_dict(self):
+        # the position is stored relative to this rank's offset, so the same state resumes every rank
+        return {
+            'current_shard': self.current_shard,
+            'current_position': self.current_position - self.B * self.T * self.process_rank,
+        }
+
+    def load_state_dict(self, state):
+        # seek straight to the saved position, no batches are replayed
+        self.current_shard = state['current_shard']
+        self.tokens = self.load_shard(self.current_shard)
+        self.current_position = state['current_position'] + self.B * self.T * self.process_rank
+
+    def next_batch(self):
+        B, T = self.B, self.T
+        buf = self.tokens[self.current_position : self.current_position+B*T+1]
+        if self.use_mmap:
+            # only the B*T+1 tokens of this batch are ever widened to int64
+            buf = widen(buf)
+        x = (buf[:-1]).view(B, T) # inputs
+        y = (buf[1:]).view(B, T) # targets
+        # advance the position in the tensor
+        self.current_position += B * T * self.num_processes
+        # if loading the next batch would be out of bounds, advance to next shard
+        if self.current_position + (B * T * self.num_processes + 1) > len(self.tokens):
+            self.current_shard = (self.current_shard + 1) % len(self.shards)
+            self.tokens = self.load_shard(self.current_shard)
+            self.current_position = B * T * self.process_rank
+        return x, y
+
+class ShuffledDataLoader:
+    """Samples T+1 token windows uniformly at random from all shards of a split.
+
+    A global index of (shard, offset) windows is built over every shard, and each epoch
+    walks a permutation of it seeded by (seed, epoch), so the order is reproducible and
+    identical on every rank. Rank r takes every num_processes-th window of the permutation.
+    Shards are memory-mapped, so a random window costs the same as a sequential one.
+    """
+
+    def __init__(self, B, T, process_rank, num_processes, split, data_root, seed=1337, master_process=True,
+                 vocab_size=None, model_hash=None):
+        self.B = B
+        self.T = T
+        self.process_rank = process_rank
+        self.num_processes = num_processes
+        self.seed = seed
+        self.shards = list_shards(data_root, split, master_process, vocab_size, model_hash)
+        self.tokens = [open_tokens(shard) for shard in self.shards]
+        # window k of shard i starts at token k*T and spans T+1 tokens (inputs plus shifted targets)
+        windows_per_shard = np.array([(len(t) - 1) // T for t in self.tokens], dtype=np.int64)
+        self.window_starts = np.concatenate([[0], np.cumsum(windows_per_shard)])
+        self.num_windows = int(self.window_starts[-1])
+        # every rank gets the same number of windows, so the ranks stay in lockstep
+        self.windows_per_rank = self.num_windows // num_processes
+        assert self.windows_per_rank >= B, f"not enough {T}-token windows in split {split} for a batch of {B}"
+        if master_process:
+            print(f"indexed {self.num_windows:,} windows of {T} tokens for split {split}")
+        self.reset()
+
+    def reset(self):
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        rng = np.random.default_rng([self.seed, epoch])
+        perm = rng.permutation(self.num_windows)[:self.windows_per_rank * self.num_processes]
+        self.order = perm[self.process_rank::self.num_processes]
+        self.current_position = 0
+
+    def state_dict(self):
+        return {
+            'seed': self.seed,
+            'epoch': self.epoch,
+            'current_position': self.current_position,
+        }
+
+    def load_state_dict(self, state):
+        assert state['seed'] == self.seed, f"loader state was saved with seed {state['seed']}, not {self.seed}"
+        # the permutation is a pure function of (seed, epoch), so rebuilding it is enough to seek
+        self.set_epoch(state['epoch'])
+        self.current_position = state['current_position']
+
+    def window(self, index):
+        # global window index -> (shard, offset)
+        shard = int(np.searchsorted(self.window_starts, index, side='right')) - 1
+        offset = int(index - self.window_starts[shard]) * self.T
+        return shard, offset
+
+    def next_batch(self):
+        B, T = self.B, self.T
+        if self.current_position + B > len(self.order):
+            self.set_epoch(self.epoch + 1)
+        buf = np.empty((B, T + 1), dtype=np.int64)
+        for b, index in enumerate(self.order[self.current_position : self.current_position+B]):
+            shard, offset = self.window(index)
+            buf[b] = self.tokens[shard][offset : offset+T+1]
+        self.current_position += B
+        buf = torch.from_numpy(buf)
+        x = buf[:, :-1].contiguous() # inputs
+        y = buf[:, 1:].contiguous() # targets
+        return x, y
+
+class ShardDataset(torch.utils.data.IterableDataset):
+    """Streams (x, y) batches from the shards of a split, for a multi-worker torch DataLoader.
+
+    The shards are dealt out round-robin over every (rank, worker) pair, so each DataLoader
+    worker of each DDP rank memory-maps and walks its own disjoint subset of the shards.
+    """
+
+    def __init__(self, B, T, process_rank, num_processes, split, data_root, master_process=True,
+                 vocab_size=None, model_hash=None):
+        super().__init__()
+        self.B = B
+        self.T = T
+        self.process_rank = process_rank
+        self.num_processes = num_processes
+        self.shards = list_shards(data_root, split, master_process, vocab_size, model_hash, min_tokens=B * T + 1)
+        self.start_batch = 0 # batches of this rank the trainer already consumed, set by WorkerDataLoader
+
+    def __iter__(self):
+        B, T = self.B, self.T
+        info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+        # the DataLoader takes batches from its workers in turn, starting at worker 0, so batch n of this rank
+        # came from worker n % num_workers. a resumed DataLoader starts over at worker 0 on batch start_batch,
+        # so this worker plays the role of the worker that batch start_batch + worker_id came from
+        role = (worker_id + self.start_batch) % num_workers
+        stream = self.process_rank * num_workers + role
+        num_streams = self.num_processes * num_workers
+        shards = self.shards[stream::num_streams]
+        assert len(shards) > 0, f"{len(self.shards)} shards are not enough for {self.num_processes} ranks x {num_workers} workers, use fewer workers"
+        tokens = [open_tokens(shard) for shard in shards]
+        batches = [(len(t) - 1) // (B * T) for t in tokens]
+        assert sum(batches) > 0, f"shards are too small for a batch of {B}x{T}"
+        # skip the share of the consumed batches that came from this role, without reading them
+        skip = (self.start_batch - role + num_workers - 1) // num_workers
+        skip %= sum(batches)
+        current_shard = 0
+        while skip >= batches[current_shard]:
+            skip -= batches[current_shard]
+            current_shard += 1
+        current_position = skip * B * T
+        while True:
+            buf = widen(tokens[current_shard][current_position : current_position+B*T+1])
+            x = (buf[:-1]).view(B, T) # inputs
+            y = (buf[1:]).view(B, T) # targets
+            yield x, y
+            current_position += B * T
+            if current_position + (B * T + 1) > len(tokens[current_shard]):
+                current_shard = (current_shard + 1) % len(tokens)
+                current_position = 0
+
+class WorkerDataLoader:
+    """Feeds the trainer from a ShardDataset through a multi-worker, pinned-memory torch DataLoader."""
+
+    def __init__(self, dataset, num_workers=4, prefetch_factor=4):
+        self.dataset = dataset
+        self.B = dataset.B
+        self.T = dataset.T
+        # every worker of every rank needs a shard of its own, small splits (like val) get fewer workers
+        max_workers = len(dataset.shards) // dataset.num_processes
+        assert max_workers > 0, f"{len(dataset.shards)} shards are not enough for {dataset.num_processes} ranks"
+        if num_workers > max_workers:
+            print(f"using {max_workers} data loader workers instead of {num_workers}, there are only {len(dataset.shards)} shards")
+            num_workers = max_workers
+        self.num_workers = num_workers
+        self.prefetch_factor = prefetch_factor
+        self.batches_consumed = 0
+        self.start()
+
+    def start(self):
+        self.dataset.start_batch = self.batches_consumed
+        kwargs = {}
+        if self.num_workers > 0:
+            kwargs = dict(persistent_workers=True, prefetch_factor=self.prefetch_factor)
+        # batch_size=None because the dataset already yields whole (B, T) batches
+        self.loader = torch.utils.data.DataLoader(self.dataset, batch_size=None, num_workers=self.num_workers,
+                                                  pin_memory=torch.cuda.is_available(), **kwargs)
+        self.iterator = iter(self.loader)
+
+    def next_batch(self):
+        x, y = next(self.iterator)
+        self.batches_consumed += 1
+        return x, y
+
+    def state_dict(self):
+        return {
+            'num_workers': self.num_workers,
+            'batches_consumed': self.batches_consumed,
+        }
+
+    def load_state_dict(self, state):
+        # the order batches come out in depends on the worker count, so it has to match
+        assert state['num_workers'] == self.num_workers, \
+            f"loader state was saved with {state['num_workers']} workers, not {self.num_workers}"
+        self.batches_consumed = state['batches_consumed']
+        # with persistent_workers the old DataLoader keeps its workers alive (and holds on to its
+        # iterator), so dropping our iterator is not enough, they are shut down before new ones start
+        if self.loader._iterator is not None:
+            self.loader._iterator._shutdown_workers()
+        del self.iterator, self.loader
+        self.start()
+
+class PrefetchDataLoader:
+    """Runs a data loader in a background thread, staging batches into pinned host buffers.
+
+    The wrapped loader (including its shard rollover) runs ahead of the trainer by up to
+    `prefetch` batches. On CUDA the staging buffers are pinned, so the trainer's
+    x.to(device, non_blocking=True) is a real async copy that overlaps with compute.
+    """
+
+    def __init__(self, loader, prefetch=4):
+        assert prefetch > 0
+        self.loader = loader
+        self.B = loader.B
+        self.T = loader.T
+        self.use_cuda = torch.cuda.is_available()
+        # one slot per prefetched batch, plus the one the trainer is currently using
+        self.slots = [tuple(torch.empty((loader.B, loader.T), dtype=torch.long, pin_memory=self.use_cuda) for _ in range(2))
+                      for _ in range(prefetch + 1)]
+        self.start()
+
+    def start(self):
+        self.free = queue.Queue()
+        self.ready = queue.Queue()
+        for i in range(len(self.slots)):
+            self.free.put((i, None))
+        self.current_slot = None
+        # the loader runs ahead of the trainer, so we track the state as of the last consumed batch
+        self.state = self.loader.state_dict()
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def _worker(self):
+        try:
+            while True:
+                i, event = self.free.get()
+                if i is None:
+                    return
+                if event is not None:
+                    # the trainer's async H2D copy out of this slot must finish before we overwrite it
+                    event.synchronize()
+                x, y = self.loader.next_batch()
+                self.slots[i][0].copy_(x)
+                self.slots[i][1].copy_(y)
+                self.ready.put((i, self.loader.state_dict()))
+        except Exception as e:
+            self.ready.put((None, e))
+
+    def next_batch(self):
+        if self.current_slot is not None:
+            # hand the previous slot back. by now the trainer has queued its copy out of it,
+            # so an event on the current stream marks when the slot is safe to reuse
+            event = None
+            if self.use_cuda:
+                event = torch.cuda.Event()
+                event.record(torch.cuda.current_stream())
+            self.free.put((self.current_slot, event))
+            self.current_slot = None
+        i, state = self.ready.get()
+        if i is None:
+            raise state
+        self.current_slot = i
+        self.state = state
+        x, y = self.slots[i]
+        return x, y
+
+    def state_dict(self):
+        return self.state
+
+    def load_state_dict(self, state):
+        # throw away whatever was prefetched from the old position and restart from the new one
+        self.close()
+        if self.use_cuda:
+            torch.cuda.synchronize()
+        self.loader.load_state_dict(state)
+        self.start()
+
+    def close(self):
+        self.free.put((None, None))
+        self.thread.join()
@@ -0,0 +1,91 @@
+import os
+import multiprocessing as mp
+from sharding import Tokenizer, imap_bounded, line_ranges, read_blocks, ShardWriter, finalize_shards, compression_report
+
+# ------------------------------------------
+# shard-gen for a whole tokenizer sweep in one pass: every block of lines is read once and
+# tokenized by every tokenizer below, each of which fills its own shard directory
+input_file = r"/home/basanta/BPE/data_preparation/cleaned_text.txt"  # Path to your local data file
+shard_size = int(1e7)  # 10 million tokens per shard
+block_lines = 4096  # lines per tokenization task, large blocks amortize the IPC of the worker pool
+parallel = False  # split input_file into line-aligned byte ranges, each worker tokenizes one and writes its own shards
+codec = None  # None for raw shards, or 'zstd', 'lz4' ('zlib' needs no extra package) for chunk-compressed ones
+transform = None  # with a codec: None, 'varint' or 'delta' (zigzag delta + varint) coding of the tokens before compression
+
+# (output directory, SentencePiece .model file or tiktoken encoding name, number of val shards)
+outputs = [
+    ("shards-bpe-16", r"/home/basanta/BPE/bpe-token-models/bpe-16.model", 5),
+    ("shards-bpe-32", r"/home/basanta/BPE/bpe-token-models/bpe-32.model", 5),
+    ("shards-bpe-50", r"/home/basanta/BPE/bpe-token-models/bpe-50.model", 5),
+    ("shards-uni-16", r"/home/basanta/BPE/uni-token-models/uni-16.model", 5),
+    ("shards-uni-32", r"/home/basanta/BPE/uni-token-models/uni-32.model", 5),
+    ("shards-uni-50", r"/home/basanta/BPE/uni-token-models/uni-50.model", 5),
+    ("shards-word-16", r"/home/basanta/BPE/word-token-models/word-16.model", 5),
+    ("shards-word-32", r"/home/basanta/BPE/word-token-models/word-32.model", 5),
+    ("shards-word-50", r"/home/basanta/BPE/word-token-models/word-50.model", 5),
+    ("shards-base", "o200k_base", 1),
+]
+
+# create the cache directories if they don't exist yet
+DATA_CACHE_DIRS = [os.path.join(os.path.dirname(__file__), local_dir) for local_dir, _, _ in outputs]
+for cache_dir in DATA_CACHE_DIRS:
+    os.makedirs(cache_dir, exist_ok=True)
+
+# load every tokenizer once, the pool workers inherit them
+tokenizers = [Tokenizer(spec) for _, spec, _ in outputs]
+
+def tokenize_block(docs):
+    # one (tokens, lengths) pair per tokenizer for the same block of documents
+    return [tok.tokenize_block(docs) for tok in tokenizers]
+
+def new_writers(prefix, progress):
+    return [ShardWriter(cache_dir, prefix, shard_size, tok.vocab_size, tok.eot, tok.model_hash, tok.dtype, progress=progress,
+                        codec=codec, transform=transform)
+            for cache_dir, tok in zip(DATA_CACHE_DIRS, tokenizers)]
+
+def write_range(args):
+    # tokenizes one byte range of input_file and writes its tokens to shards of its own, for every tokenizer
+    part, start, end = args
+    writers = new_writers(f"nepberta_part{part:03d}", progress=False)
+    for block in read_blocks(input_file, block_lines, start, end):
+        for writer, (tokens, lengths) in zip(writers, tokenize_block(block)):
+            writer.add(tokens, lengths)
+    for writer in writers:
+        writer.close()
+    return [{'start': start, 'end': end, 'shards': writer.shards} for writer in writers]
+
+if __name__ == '__main__':
+    nprocs = max(1, os.cpu_count() // 2)
+    max_pending = 2 * nprocs  # blocks tokenized ahead of the writers, each holds the tokens of every tokenizer
+    if parallel:
+        ranges = line_ranges(input_file, nprocs)
+        with mp.Pool(nprocs) as pool:
+            results = pool.map(write_range, [(i, start, end) for i, (start, end) in enumerate(ranges)])
+        # regroup from per range to per tokenizer
+        parts = [[result[t] for result in results] for t in range(len(tokenizers))]
+    else:
+        # the progress bars of ten writers would interleave, so they stay off here
+        writers = new_writers("nepberta_part000", progress=False)
+        with mp.Pool(nprocs) as pool:
+            for blocks in imap_bounded(pool, tokenize_block, read_blocks(input_file, block_lines), max_pending):
+                for writer, (tokens, lengths) in zip(writers, blocks):
+                    writer.add(tokens, lengths)
+        for writer in writers:
+            writer.close()
+        parts = [[{'start': 0, 'end': os.path.getsize(input_file), 'shards': writer.shards}] for writer in writers]
+
+    # give the shards of every tokenizer their global names and record them in its manifest
+    for (local_dir, spec, num_val_shards), cache_dir, tok, tok_parts in zip(outputs, DATA_CACHE_DIRS, tokenizers, parts):
+        shards = finalize_shards(cache_dir, tok_parts, num_val_shards, {
+            'tokenizer': spec,
+            'model_hash': tok.model_hash.hex(),
+            'vocab_size': tok.vocab_size,
+            'eot': tok.eot,
+            'input_file': input_file,
+            'shard_size': shard_size,
+            'codec': codec,
+            'transform': transform,
+        })
+        print(f"{local_dir}: wrote {len(shards)} shards with {sum(s['num_tokens'] for s in shards):,} tokens")
+        if codec is not None:
+            compression_report(cache_dir, shards)
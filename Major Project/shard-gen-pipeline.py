@@ -0,0 +1,130 @@
+import os
+import re
+import sys
+import csv
+import time
+import multiprocessing as mp
+import numpy as np
+from sharding import Tokenizer, ShardWriter, imap_bounded, finalize_shards, compression_report
+from data_preparation.cleaning import clean_text, clean_non_devanagari, normalize_line, line_hashes, SeenHashes
+from data_preparation.quality import THRESHOLDS, quality_mask
+
+# ------------------------------------------
+# raw data to training shards in one streaming pass, instead of the notebook csv export, split.py,
+# combine.py, clean-data.py and shard-gen.py each reading and writing the whole corpus:
+# csv rows (or lines of text parts) -> clean_text dateline stripping (csv only) -> clean_non_devanagari
+# -> drop empty, low quality (optional) and duplicate lines -> tokenize -> shards
+sources = [r"/home/basanta/BPE/data_preparation/clean_date_categories.csv"]  # .csv exports, or text parts with one document per line
+text_column = 'text'  # the column of the csv that holds the article text
+local_dir = "shards-word-50"
+tokenizer = r"/home/basanta/BPE/word-token-models/word-50.model"  # SentencePiece .model file or tiktoken encoding name
+shard_size = int(1e7)  # 10 million tokens per shard
+block_docs = 512  # csv rows (or text lines) per pool task
+num_val_shards = 5  # the first shards of the corpus are the validation split
+dedup = True  # drop every cleaned line that was already seen, compared like data_preparation/dedup.py does (NFC, whitespace collapsed)
+dedup_memory_budget = 1 << 30  # bytes of line hashes (8 per unique line) kept in memory before spilling them to disk
+dedup_spill_dir = "dedup_runs"
+quality_filter = False  # drop the lines that fail the rules of data_preparation/quality.py
+quality_thresholds = dict(THRESHOLDS)  # see quality-filter.py for a per-rule report of what these drop
+codec = None  # None for raw shards, or 'zstd', 'lz4' ('zlib' needs no extra package) for chunk-compressed ones
+transform = None  # with a codec: None, 'varint' or 'delta' (zigzag delta + varint) coding of the tokens before compression
+nprocs = max(1, os.cpu_count() // 2)
+max_pending = 4 * nprocs  # blocks in flight at once, this bounds the memory of the whole pipeline
+
+# create the cache directory if it doesn't exist yet
+DATA_CACHE_DIR = os.path.join(os.path.dirname(__file__), local_dir)
+os.makedirs(DATA_CACHE_DIR, exist_ok=True)
+
+# load the tokenizer once, the pool workers inherit it
+tok = Tokenizer(tokenizer)
+
+# the line breaks of python's universal newlines, which is how the exported text files were read back
+LINE_BREAK = re.compile(r'\r\n|\r|\n')
+
+def read_documents(path):
+    if path.endswith('.csv'):
+        csv.field_size_limit(sys.maxsize)  # articles can be longer than the default field limit
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                text = row.get(text_column)
+                if text and text.strip():  # the notebook drops the NaN (empty) rows
+                    yield clean_text(text)
+    else:
+        # text parts were exported from the csv, so clean_text was already applied to them
+        with open(path, encoding='utf-8') as f:
+            yield from f
+
+def read_blocks():
+    block = []
+    for path in sources:
+        for doc in read_documents(path):
+            block.append(doc)
+            if len(block) == block_docs:
+                yield block
+                block = []
+    if block:
+        yield block
+
+def process_block(docs):
+    # runs in a pool worker: every line of every document is cleaned, empty (and low quality) lines
+    # are dropped, and the rest is hashed (for dedup in the main process) and tokenized, one document per line
+    lines = []
+    for doc in docs:
+        for line in LINE_BREAK.split(doc):
+            cleaned = clean_non_devanagari(line)
+            if cleaned:
+                lines.append(cleaned)
+    num_cleaned = len(lines)
+    if quality_filter:
+        keep, _, _ = quality_mask(lines, quality_thresholds)
+        lines = [line for line, k in zip(lines, keep) if k]
+    tokens, lengths = tok.tokenize_block(lines)
+    hashes = line_hashes([normalize_line(line) for line in lines]) if dedup else None
+    return tokens, lengths, hashes, num_cleaned - len(lines), len(docs), sum(len(doc.encode('utf-8')) for doc in docs)
+
+if __name__ == '__main__':
+    t0 = time.time()
+    seen = SeenHashes(dedup_memory_budget, dedup_spill_dir)
+    writer = ShardWriter(DATA_CACHE_DIR, "nepberta_part000", shard_size, tok.vocab_size, tok.eot, tok.model_hash, tok.dtype,
+                         progress=False, codec=codec, transform=transform)
+    num_docs = num_bytes = num_lines = num_low_quality = num_kept = 0
+    with mp.Pool(nprocs) as pool:
+        for i, (tokens, lengths, hashes, n_low_quality, n_docs, n_bytes) in enumerate(imap_bounded(pool, process_block, read_blocks(), max_pending)):
+            num_docs += n_docs
+            num_bytes += n_bytes
+            num_lines += len(lengths) + n_low_quality
+            num_low_quality += n_low_quality
+            if dedup:
+                # the blocks come back in input order, so the first occurrence of a line is the one kept
+                keep = seen.add(hashes)
+                tokens = tokens[np.repeat(keep, lengths)]
+                lengths = lengths[keep]
+            num_kept += len(lengths)
+            writer.add(tokens, lengths)
+            if i % 100 == 0:
+                dt = time.time() - t0
+                print(f"{num_docs:,} documents | {num_lines:,} lines | {num_lines - num_low_quality - num_kept:,} duplicates | "
+                      f"{num_docs / dt:,.0f} docs/s | {num_bytes / dt / 1e6:.1f} MB/s")
+    writer.close()
+    seen.close()
+
+    # give the shards their global names and record them in the manifest
+    parts = [{'start': 0, 'end': num_bytes, 'shards': writer.shards}]
+    shards = finalize_shards(DATA_CACHE_DIR, parts, num_val_shards, {
+        'tokenizer': tokenizer,
+        'model_hash': tok.model_hash.hex(),
+        'vocab_size': tok.vocab_size,
+        'eot': tok.eot,
+        'sources': sources,
+        'shard_size': shard_size,
+        'dedup': dedup,
+        'quality_thresholds': quality_thresholds if quality_filter else None,
+        'codec': codec,
+        'transform': transform,
+    })
+    dt = time.time() - t0
+    print(f"{num_docs:,} documents ({num_bytes / 1e6:.1f} MB) -> {num_lines:,} cleaned lines, "
+          f"{num_low_quality:,} low quality and {num_lines - num_low_quality - num_kept:,} duplicates dropped, in {dt:.1f}s")
+    print(f"wrote {len(shards)} shards with {sum(s['num_tokens'] for s in shards):,} tokens to {DATA_CACHE_DIR}")
+    if codec is not None:
+        compression_report(DATA_CACHE_DIR, shards)
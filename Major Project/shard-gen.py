@@ -1,71 +1,85 @@
 import os
 import multiprocessing as mp
-import numpy as np
-import sentencepiece as spm
-from tqdm import tqdm
+from sharding import Tokenizer, imap_bounded, line_ranges, read_blocks, ShardWriter, plan_chunks, finalize_shards, compression_report
 
 # ------------------------------------------
 local_dir = "shards-word-50"
 input_file = r"/home/basanta/BPE/data_preparation/cleaned_text.txt"  # Path to your local data file
 shard_size = int(1e7)  # 10 million tokens per shard
+block_lines = 4096  # lines per tokenization task, large blocks amortize the IPC of the worker pool
+num_val_shards = 5  # the first shards of the corpus are the validation split
+parallel = False  # split input_file into line-aligned byte ranges, each worker tokenizes one and writes its own shards
+codec = None  # None for raw shards, or 'zstd', 'lz4' ('zlib' needs no extra package) for chunk-compressed ones
+transform = None  # with a codec: None, 'varint' or 'delta' (zigzag delta + varint) coding of the tokens before compression
+incremental = False  # keep the shards of every input chunk whose content is unchanged since the last run, tokenize only the rest
+chunk_bytes = 1 << 28  # size of the input chunks that incremental runs hash and compare
 
 # create the cache directory if it doesn't exist yet
 DATA_CACHE_DIR = os.path.join(os.path.dirname(__file__), local_dir)
 os.makedirs(DATA_CACHE_DIR, exist_ok=True)
 
 # Load SentencePiece tokenizer
-sp = spm.SentencePieceProcessor()
-sp.load(r"/home/basanta/BPE/word-token-models/word-50.model")
+model_file = r"/home/basanta/BPE/word-token-models/word-50.model"
+tok = Tokenizer(model_file)  # the <eos> token ID (or <unk>) is the eot, see sharding.Tokenizer
+vocab_size = tok.vocab_size
+eot = tok.eot
+model_hash = tok.model_hash
+token_dtype = tok.dtype # uint16 for every vocab below 65536, else uint32
 
-# Get the <eos> token ID or define your own special token
-eot = sp.piece_to_id("</s>") if sp.piece_to_id("</s>") != 0 else sp.piece_to_id("<unk>")
+def tokenize_block(docs):
+    # every document starts with eot, all of them concatenated into one array of token_dtype tokens,
+    # plus the token length of every document
+    return tok.tokenize_block(docs)
 
-def tokenize(doc):
-    # tokenizes a single document and returns a numpy array of uint16 tokens
-    tokens = [eot]  # Add special end-of-text token at start
-    tokens.extend(sp.encode(doc, out_type=int))
-    tokens_np = np.array(tokens, dtype=np.uint32)
-    tokens_np_uint16 = tokens_np.astype(np.uint16)  # Assuming vocab size < 65536
-    return tokens_np_uint16
+def new_writer(prefix, progress):
+    return ShardWriter(DATA_CACHE_DIR, prefix, shard_size, vocab_size, eot, model_hash, token_dtype, progress=progress,
+                       codec=codec, transform=transform)
 
-def write_datafile(filename, tokens_np):
-    np.save(filename, tokens_np)
-
-def read_local_data(file_path):
-    # Reads local data file line by line
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            yield line.strip()
+def write_range(args):
+    # tokenizes one byte range of input_file and writes its tokens to shards of its own
+    part, start, end = args
+    writer = new_writer(f"nepberta_part{part:03d}", progress=False)
+    for block in read_blocks(input_file, block_lines, start, end):
+        tokens, lengths = tokenize_block(block)
+        writer.add(tokens, lengths)
+    writer.close()
+    return {'start': start, 'end': end, 'shards': writer.shards}
 
 if __name__ == '__main__':
     nprocs = max(1, os.cpu_count() // 2)
-    with mp.Pool(nprocs) as pool:
-        shard_index = 0
-        all_tokens_np = np.empty((shard_size,), dtype=np.uint32)
-        token_count = 0
-        progress_bar = None
-
-        for tokens in pool.imap(tokenize, read_local_data(input_file), chunksize=16):
-            if token_count + len(tokens) < shard_size:
-                all_tokens_np[token_count:token_count + len(tokens)] = tokens
-                token_count += len(tokens)
-                if progress_bar is None:
-                    progress_bar = tqdm(total=shard_size, unit="tokens", desc=f"Shard {shard_index}")
-                progress_bar.update(len(tokens))
-            else:
-                split = "val" if shard_index < 5 else "train"
-                filename = os.path.join(DATA_CACHE_DIR, f"nepberta_{split}_{shard_index:06d}")
-                remainder = shard_size - token_count
-                progress_bar.update(remainder)
-                all_tokens_np[token_count:token_count + remainder] = tokens[:remainder]
-                write_datafile(filename, all_tokens_np)
-                shard_index += 1
-                progress_bar = None
-                all_tokens_np[0:len(tokens) - remainder] = tokens[remainder:]
-                token_count = len(tokens) - remainder
+    max_pending = 4 * nprocs  # blocks tokenized ahead of the writer, this bounds the memory of the serial path
+    if incremental:
+        # only the chunks that are new or changed since the manifest of the last run get tokenized
+        parts, todo = plan_chunks(input_file, chunk_bytes, DATA_CACHE_DIR, model_hash, shard_size, codec, transform)
+        print(f"{len(todo)} of {len(parts)} chunks of {input_file} are new or changed")
+        with mp.Pool(nprocs) as pool:
+            for (i, start, end), part in zip(todo, pool.imap(write_range, todo)):
+                parts[i]['shards'] = part['shards']
+    elif parallel:
+        # independent writers, one per byte range, so tokenization and disk writes both scale with cores
+        ranges = line_ranges(input_file, nprocs)
+        with mp.Pool(nprocs) as pool:
+            parts = pool.map(write_range, [(i, start, end) for i, (start, end) in enumerate(ranges)])
+    else:
+        # a single writer in this process, the pool only tokenizes
+        writer = new_writer("nepberta_part000", progress=True)
+        with mp.Pool(nprocs) as pool:
+            for tokens, lengths in imap_bounded(pool, tokenize_block, read_blocks(input_file, block_lines), max_pending):
+                writer.add(tokens, lengths)
+        writer.close()
+        parts = [{'start': 0, 'end': os.path.getsize(input_file), 'shards': writer.shards}]
 
-        # write remaining tokens
-        if token_count != 0:
-            split = "val" if shard_index < 5 else "train"
-            filename = os.path.join(DATA_CACHE_DIR, f"nepberta_{split}_{shard_index:06d}")
-            write_datafile(filename, all_tokens_np[:token_count])
+    # give the shards their global names and record them in the manifest
+    shards = finalize_shards(DATA_CACHE_DIR, parts, num_val_shards, {
+        'tokenizer': model_file,
+        'model_hash': model_hash.hex(),
+        'vocab_size': vocab_size,
+        'eot': eot,
+        'input_file': input_file,
+        'shard_size': shard_size,
+        'codec': codec,
+        'transform': transform,
+    })
+    print(f"wrote {len(shards)} shards with {sum(s['num_tokens'] for s in shards):,} tokens to {DATA_CACHE_DIR}")
+    if codec is not None:
+        compression_report(DATA_CACHE_DIR, shards)
@@ -0,0 +1,317 @@
+import os
+import struct
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# self-describing token shard format, written by shard-gen*.py and read by dataloader.py
+#
+# a shard is a fixed 256 byte header followed by the raw little-endian tokens:
+#   magic (8s) | version (u32) | itemsize (u32) | token count (u64) | vocab size (u64) |
+#   eot id (u64) | tokenizer model hash (32s, sha256) | zero padding up to 256 bytes
+#
+# a compressed shard (version 2) has the same header, with four more fields after the hash:
+#   codec (u32) | transform (u32) | tokens per chunk (u64) | chunk count (u64)
+# and instead of the raw tokens, a table of chunk count + 1 u64 byte offsets (relative to the
+# end of the table) followed by the independently compressed chunks, so any window of tokens
+# is read by decompressing only the chunks it overlaps
+#
+# next to every shard, a .idx sidecar holds the token offset at which every document of the
+# shard starts, after a 256 byte header of its own:
+#   magic (8s) | version (u32) | itemsize (u32) | document count (u64) | token count (u64) |
+#   zero padding up to 256 bytes
+# followed by document count + 1 little-endian offsets, the last one being the token count.
+# a document that runs past the end of its shard continues at the start of the next shard,
+# before the first offset of that shard's index
+
+SHARD_MAGIC = b"NEPSHARD"
+SHARD_VERSION = 1
+COMPRESSED_VERSION = 2
+SHARD_EXT = ".bin"
+HEADER_SIZE = 256
+HEADER_STRUCT = struct.Struct("<8sIIQQQ32s")
+DTYPES = {2: np.uint16, 4: np.uint32}
+CHUNK_STRUCT = struct.Struct("<IIQQ")
+CODECS = {'zlib': 1, 'zstd': 2, 'lz4': 3}
+TRANSFORMS = {None: 0, 'varint': 1, 'delta': 2} # delta is zigzag delta coding followed by varint
+INDEX_MAGIC = b"NEPINDEX"
+INDEX_VERSION = 1
+INDEX_EXT = ".idx"
+INDEX_STRUCT = struct.Struct("<8sIIQQ")
+INDEX_DTYPES = {4: np.uint32, 8: np.uint64}
+
+def pick_dtype(vocab_size):
+    # the smallest token dtype that can hold every id of the vocab
+    if vocab_size < 2**16:
+        return np.uint16
+    assert vocab_size < 2**32, "token dictionary too large for uint32"
+    return np.uint32
+
+def tokenizer_hash(model):
+    # sha256 of a tokenizer model file, or of the name for built-in encodings (e.g. tiktoken's o200k_base)
+    h = hashlib.sha256()
+    if os.path.isfile(model):
+        with open(model, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    else:
+        h.update(model.encode("utf-8"))
+    return h.digest()
+
+def index_path(filename):
+    # the .idx sidecar of a shard
+    return os.path.splitext(filename)[0] + INDEX_EXT
+
+def write_shard(filename, tokens_np, vocab_size, eot, model_hash, doc_starts=None, codec=None, transform=None,
+                chunk_tokens=1 << 16):
+    dtype = pick_dtype(vocab_size)
+    assert tokens_np.dtype == dtype, f"expected {np.dtype(dtype).name} tokens for vocab size {vocab_size}, got {tokens_np.dtype}"
+    if not filename.endswith(SHARD_EXT):
+        filename += SHARD_EXT
+    if codec is None:
+        assert transform is None, "a transform needs a codec"
+        header = HEADER_STRUCT.pack(SHARD_MAGIC, SHARD_VERSION, np.dtype(dtype).itemsize,
+                                    len(tokens_np), vocab_size, eot, model_hash)
+        with open(filename, "wb") as f:
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
+            tokens_np.astype(np.dtype(dtype).newbyteorder("<"), copy=False).tofile(f)
+    else:
+        assert codec in CODECS, f"unknown codec {codec}, expected one of {list(CODECS)}"
+        assert transform in TRANSFORMS, f"unknown transform {transform}, expected one of {list(TRANSFORMS)}"
+        chunks = [compress(encode_chunk(tokens_np[i:i + chunk_tokens], transform), codec)
+                  for i in range(0, len(tokens_np), chunk_tokens)]
+        offsets = np.concatenate([[0], np.cumsum([len(c) for c in chunks], dtype=np.uint64)]).astype("<u8")
+        header = HEADER_STRUCT.pack(SHARD_MAGIC, COMPRESSED_VERSION, np.dtype(dtype).itemsize,
+                                    len(tokens_np), vocab_size, eot, model_hash)
+        header += CHUNK_STRUCT.pack(CODECS[codec], TRANSFORMS[transform], chunk_tokens, len(chunks))
+        with open(filename, "wb") as f:
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
+            f.write(offsets.tobytes())
+            for chunk in chunks:
+                f.write(chunk)
+    if doc_starts is not None:
+        write_index(index_path(filename), doc_starts, len(tokens_np))
+
+def write_index(filename, doc_starts, num_tokens):
+    # doc_starts are the (increasing) token offsets of the documents that start in the shard
+    offsets = np.append(np.asarray(doc_starts, dtype=np.uint64), np.uint64(num_tokens))
+    assert (np.diff(offsets.astype(np.int64)) >= 0).all(), "document offsets must be increasing and within the shard"
+    dtype = np.uint32 if num_tokens < 2**32 else np.uint64
+    header = INDEX_STRUCT.pack(INDEX_MAGIC, INDEX_VERSION, np.dtype(dtype).itemsize, len(offsets) - 1, num_tokens)
+    with open(filename, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        offsets.astype(np.dtype(dtype).newbyteorder("<")).tofile(f)
+
+def read_header(filename):
+    with open(filename, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+    assert len(raw) == HEADER_SIZE, f"{filename} is too short to be a shard"
+    magic, version, itemsize, num_tokens, vocab_size, eot, model_hash = HEADER_STRUCT.unpack_from(raw)
+    assert magic == SHARD_MAGIC, f"{filename} is not a token shard (bad magic)"
+    assert version in (SHARD_VERSION, COMPRESSED_VERSION), f"{filename} has unsupported shard version {version}"
+    assert itemsize in DTYPES, f"{filename} has unsupported token size {itemsize}"
+    header = {
+        'version': version,
+        'dtype': DTYPES[itemsize],
+        'num_tokens': num_tokens,
+        'vocab_size': vocab_size,
+        'eot': eot,
+        'model_hash': model_hash,
+        'codec': None,
+    }
+    if version == COMPRESSED_VERSION:
+        codec, transform, chunk_tokens, num_chunks = CHUNK_STRUCT.unpack_from(raw, HEADER_STRUCT.size)
+        header['codec'] = {v: k for k, v in CODECS.items()}[codec]
+        header['transform'] = {v: k for k, v in TRANSFORMS.items()}[transform]
+        header['chunk_tokens'] = chunk_tokens
+        header['num_chunks'] = num_chunks
+    return header
+
+def open_shard(filename):
+    # memory-map the tokens of a shard, the header tells us their dtype and count.
+    # a compressed shard is opened as a CompressedShard, which slices the same way
+    header = read_header(filename)
+    if header['codec'] is not None:
+        return CompressedShard(filename, header)
+    dtype = np.dtype(header['dtype']).newbyteorder("<")
+    return np.memmap(filename, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(header['num_tokens'],))
+
+def read_shard(filename):
+    # read all tokens of a shard into memory
+    header = read_header(filename)
+    if header['codec'] is not None:
+        return CompressedShard(filename, header, cache_chunks=0)[:]
+    dtype = np.dtype(header['dtype']).newbyteorder("<")
+    return np.fromfile(filename, dtype=dtype, count=header['num_tokens'], offset=HEADER_SIZE)
+
+# -----------------------------------------------------------------------------
+# compressed shards
+
+def compress(data, codec):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == 'lz4':
+        import lz4.frame
+        return lz4.frame.compress(data)
+    import zlib
+    return zlib.compress(data, 6)
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'lz4':
+        import lz4.frame
+        return lz4.frame.decompress(data)
+    import zlib
+    return zlib.decompress(data)
+
+def varint_encode(values):
+    # LEB128 varints of a uint64 array: 7 bits per byte, the high bit set on all but the last byte
+    values = values.astype(np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += values >= np.uint64(1 << (7 * k))
+    starts = np.cumsum(nbytes) - nbytes
+    owner = np.repeat(np.arange(len(values)), nbytes)
+    k = np.arange(int(nbytes.sum())) - starts[owner]
+    out = ((values[owner] >> (7 * k).astype(np.uint64)) & np.uint64(0x7f)).astype(np.uint8)
+    out[k < nbytes[owner] - 1] |= 0x80
+    return out
+
+def varint_decode(data):
+    data = np.frombuffer(data, dtype=np.uint8)
+    if len(data) == 0:
+        return np.empty(0, dtype=np.uint64)
+    last = data < 0x80
+    starts = np.concatenate([[0], np.flatnonzero(last)[:-1] + 1])
+    owner = np.concatenate([[0], np.cumsum(last[:-1])])
+    k = np.arange(len(data)) - starts[owner]
+    return np.add.reduceat((data & 0x7f).astype(np.uint64) << (7 * k).astype(np.uint64), starts)
+
+def encode_chunk(tokens, transform):
+    # the bytes of a chunk of tokens, before compression
+    if transform is None:
+        return tokens.astype(tokens.dtype.newbyteorder("<"), copy=False).tobytes()
+    values = tokens.astype(np.int64)
+    if transform == 'delta':
+        d = np.diff(values, prepend=0)
+        values = (d << 1) ^ (d >> 63) # zigzag, so small negative deltas stay small
+    return varint_encode(values).tobytes()
+
+def decode_chunk(data, transform, dtype):
+    if transform is None:
+        return np.frombuffer(data, dtype=np.dtype(dtype).newbyteorder("<"))
+    values = varint_decode(data)
+    if transform == 'delta':
+        d = (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+        values = np.cumsum(d)
+    return values.astype(dtype)
+
+class CompressedShard:
+    """The tokens of a compressed shard, sliced like a memory-mapped one.
+
+    The chunk offset table is memory-mapped, and a slice decompresses only the chunks it
+    overlaps. The last few decoded chunks are cached, since consecutive batches mostly
+    fall into the same chunk.
+    """
+
+    def __init__(self, filename, header=None, cache_chunks=4):
+        self.filename = filename
+        self.header = header if header is not None else read_header(filename)
+        assert self.header['codec'] is not None, f"{filename} is not a compressed shard"
+        self.dtype = self.header['dtype']
+        self.num_tokens = self.header['num_tokens']
+        self.chunk_tokens = self.header['chunk_tokens']
+        num_chunks = self.header['num_chunks']
+        self.offsets = np.memmap(filename, dtype="<u8", mode='r', offset=HEADER_SIZE, shape=(num_chunks + 1,))
+        self.data_start = HEADER_SIZE + 8 * (num_chunks + 1)
+        self.cache_chunks = cache_chunks
+        self.cache = OrderedDict()
+
+    def __len__(self):
+        return self.num_tokens
+
+    def chunk(self, i):
+        if i in self.cache:
+            self.cache.move_to_end(i)
+            return self.cache[i]
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        with open(self.filename, "rb") as f:
+            f.seek(self.data_start + start)
+            data = f.read(end - start)
+        tokens = decode_chunk(decompress(data, self.header['codec']), self.header['transform'], self.dtype)
+        if self.cache_chunks > 0:
+            self.cache[i] = tokens
+            if len(self.cache) > self.cache_chunks:
+                self.cache.popitem(last=False)
+        return tokens
+
+    def __getitem__(self, index):
+        # only contiguous slices are supported, which is all the loaders take
+        assert isinstance(index, slice) and index.step in (None, 1), "compressed shards only support contiguous slices"
+        start, stop, _ = index.indices(self.num_tokens)
+        if stop <= start:
+            return np.empty(0, dtype=self.dtype)
+        first, last = start // self.chunk_tokens, (stop - 1) // self.chunk_tokens
+        parts = [self.chunk(i) for i in range(first, last + 1)]
+        tokens = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        offset = first * self.chunk_tokens
+        return tokens[start - offset:stop - offset]
+
+def check_shard(filename, vocab_size, model_hash=None):
+    # refuse shards that were written by a different tokenizer, or whose ids do not fit the model
+    header = read_header(filename)
+    assert header['vocab_size'] <= vocab_size, \
+        f"{filename} was tokenized with a vocab of {header['vocab_size']}, but the model only has {vocab_size} embeddings"
+    if model_hash is not None:
+        assert header['model_hash'] == model_hash, \
+            f"{filename} was tokenized with a different tokenizer model than the one this run uses"
+    return header
+
+def open_index(filename):
+    # memory-map the document offsets of a shard's .idx sidecar (document count + 1 entries)
+    with open(filename, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+    assert len(raw) == HEADER_SIZE, f"{filename} is too short to be a shard index"
+    magic, version, itemsize, num_docs, num_tokens = INDEX_STRUCT.unpack_from(raw)
+    assert magic == INDEX_MAGIC, f"{filename} is not a shard index (bad magic)"
+    assert version == INDEX_VERSION, f"{filename} has unsupported index version {version}"
+    assert itemsize in INDEX_DTYPES, f"{filename} has unsupported offset size {itemsize}"
+    dtype = np.dtype(INDEX_DTYPES[itemsize]).newbyteorder("<")
+    return np.memmap(filename, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(num_docs + 1,))
+
+class IndexedShard:
+    """A shard and its .idx sidecar, both memory-mapped, so any document is an O(1) slice."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.header = read_header(filename)
+        self.tokens = open_shard(filename)
+        sidecar = index_path(filename)
+        assert os.path.exists(sidecar), f"{filename} has no {INDEX_EXT} sidecar, re-run shard-gen to write one"
+        self.offsets = open_index(sidecar)
+        assert int(self.offsets[-1]) == len(self.tokens), f"{sidecar} does not match the token count of {filename}"
+
+    def __len__(self):
+        # the number of documents that start in this shard
+        return len(self.offsets) - 1
+
+    def span(self, i):
+        # [start, end) token offsets of document i. the last document may be cut off at the end of the shard
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def __getitem__(self, i):
+        # the tokens of document i (starting with its EOT), as a view into the memory-mapped shard
+        if i < 0:
+            i += len(self)
+        assert 0 <= i < len(self), f"document {i} out of range for {self.filename} with {len(self)} documents"
+        start, end = self.span(i)
+        return self.tokens[start:end]
+
+    def document_at(self, position):
+        # the document that token `position` belongs to, e.g. to map a batch back to its source.
+        # -1 for the tokens before the first offset, which belong to a document of the previous shard
+        return int(np.searchsorted(self.offsets, position, side='right')) - 1
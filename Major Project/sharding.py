@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import numpy as np
+from collections import deque
+from tqdm import tqdm
+from shard_format import SHARD_EXT, write_shard, read_shard, read_header, pick_dtype, tokenizer_hash, index_path
+
+# -----------------------------------------------------------------------------
+# helpers shared by shard-gen.py, shard-gen-base.py and shard-gen-multi.py (line_ranges and
+# chunk_ranges also by data_preparation/split.py and corpus-stats.py)
+
+def line_ranges(file_path, num_ranges, range_bytes=None):
+    # splits a file into up to num_ranges byte ranges of about equal size (or of range_bytes
+    # each), each starting and ending on a line boundary, so every range can be read by a
+    # different process
+    size = os.path.getsize(file_path)
+    bounds = [0]
+    with open(file_path, 'rb') as f:
+        for i in range(1, num_ranges):
+            pos = range_bytes * i if range_bytes is not None else size * i // num_ranges
+            pos = min(max(pos, bounds[-1]), size)
+            if pos == 0:
+                continue
+            # snap forward to the start of the next line (a range already on one stays put)
+            f.seek(pos - 1)
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+def chunk_ranges(file_path, chunk_bytes):
+    # splits a file into line-aligned chunks of about chunk_bytes bytes. the boundaries only
+    # depend on the bytes before them, so appending to the file leaves all but the last chunk as is
+    size = os.path.getsize(file_path)
+    return line_ranges(file_path, max(1, -(-size // chunk_bytes)), chunk_bytes)
+
+def range_hash(file_path, start, end):
+    # sha256 of the bytes [start, end) of a file
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = f.read(min(remaining, 1 << 20))
+            if not data:
+                break
+            h.update(data)
+            remaining -= len(data)
+    return h.hexdigest()
+
+def read_lines(file_path, start=0, end=None):
+    # reads the lines of a byte range of the data file (the whole file by default)
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        for line in f:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            yield line.decode('utf-8').strip()
+
+def read_blocks(file_path, block_lines, start=0, end=None):
+    # groups the lines of a byte range of the data file into lists of block_lines lines
+    block = []
+    for line in read_lines(file_path, start, end):
+        block.append(line)
+        if len(block) == block_lines:
+            yield block
+            block = []
+    if block:
+        yield block
+
+def imap_bounded(pool, func, iterable, max_pending):
+    # like pool.imap, results in input order, but at most max_pending tasks are submitted
+    # ahead of the consumer. pool.imap reads its whole input as fast as it can, which for
+    # a reader over a large file means holding most of the file in memory
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def imap_unordered_bounded(pool, func, iterable, max_pending):
+    # like pool.imap_unordered, results in the order they finish, with at most max_pending
+    # tasks submitted ahead of the consumer. the pool's result thread puts every result (or
+    # the error of a failed task) on a queue, which the consumer takes them from
+    done = queue.Queue()
+    def take():
+        ok, value = done.get()
+        if not ok:
+            raise value
+        return value
+    pending = 0
+    for item in iterable:
+        pool.apply_async(func, (item,), callback=lambda value: done.put((True, value)),
+                         error_callback=lambda e: done.put((False, e)))
+        pending += 1
+        if pending >= max_pending:
+            yield take()
+            pending -= 1
+    for _ in range(pending):
+        yield take()
+
+class Tokenizer:
+    """A SentencePiece .model file or a tiktoken encoding name, with the EOT conventions of shard-gen."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        if spec.endswith('.model'):
+            import sentencepiece as spm
+            self.sp = spm.SentencePieceProcessor()
+            self.sp.load(spec)
+            self.enc = None
+            self.vocab_size = self.sp.get_piece_size()
+            # the same <eos>-or-<unk> choice as shard-gen.py
+            self.eot = self.sp.piece_to_id("</s>") if self.sp.piece_to_id("</s>") != 0 else self.sp.piece_to_id("<unk>")
+        else:
+            import tiktoken
+            self.sp = None
+            self.enc = tiktoken.get_encoding(spec)
+            self.vocab_size = self.enc.n_vocab
+            self.eot = self.enc._special_tokens['<|endoftext|>']
+        self.model_hash = tokenizer_hash(spec)
+        self.dtype = pick_dtype(self.vocab_size)
+
+    def encode(self, doc):
+        if self.sp is not None:
+            return self.sp.encode(doc, out_type=int)
+        return self.enc.encode_ordinary(doc)
+
+    def encode_batch(self, docs):
+        if self.sp is not None:
+            return self.sp.encode(docs, out_type=int)
+        return self.enc.encode_ordinary_batch(docs, num_threads=1)
+
+    def decode(self, ids):
+        if self.sp is not None:
+            return self.sp.decode(ids)
+        return self.enc.decode(ids)
+
+    def tokenize_block(self, docs):
+        # every document starts with eot, all of them are concatenated into one array, and the
+        # token length of every document is returned alongside. the tokenize_block of every shard-gen script
+        tokens = []
+        lengths = np.empty(len(docs), dtype=np.int64)
+        for i, ids in enumerate(self.encode_batch(docs)):
+            tokens.append(self.eot)
+            tokens.extend(ids)
+            lengths[i] = len(ids) + 1
+        tokens_np = np.array(tokens, dtype=np.int64)
+        assert (0 <= tokens_np).all() and (tokens_np < self.vocab_size).all(), "token id outside of the tokenizer vocab"
+        return tokens_np.astype(self.dtype), lengths
+
+class ShardWriter:
+    """Packs token arrays into shards of shard_size tokens, writing each shard (and its .idx sidecar) as soon as it is full."""
+
+    def __init__(self, out_dir, prefix, shard_size, vocab_size, eot, model_hash, dtype, progress=True,
+                 codec=None, transform=None):
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.vocab_size = vocab_size
+        self.eot = eot
+        self.model_hash = model_hash
+        self.progress = progress
+        self.codec = codec # None writes raw shards, 'zstd', 'lz4' or 'zlib' chunk-compressed ones
+        self.transform = transform
+        # preallocate buffer to hold current shard
+        self.buf = np.empty((shard_size,), dtype=dtype)
+        self.token_count = 0
+        self.progress_bar = None
+        self.shards = [] # (filename, num_tokens) of every shard written so far
+        self.doc_starts = [] # offsets of the documents that start in the current shard
+
+    def add(self, tokens, lengths):
+        # lengths are the token counts of the documents in tokens, as returned by tokenize_block
+        starts = np.cumsum(lengths) - lengths # offset of every document within tokens
+        while len(tokens) > 0:
+            if self.progress and self.progress_bar is None:
+                self.progress_bar = tqdm(total=self.shard_size, unit="tokens", desc=f"Shard {len(self.shards)}")
+            # copy whatever fits into the current shard, the rest goes to the next one
+            n = min(self.shard_size - self.token_count, len(tokens))
+            k = np.searchsorted(starts, n)
+            self.doc_starts.append(starts[:k] + self.token_count)
+            starts = starts[k:] - n
+            self.buf[self.token_count:self.token_count + n] = tokens[:n]
+            self.token_count += n
+            if self.progress_bar is not None:
+                self.progress_bar.update(n)
+            tokens = tokens[n:]
+            if self.token_count == self.shard_size:
+                self.flush()
+
+    def flush(self):
+        if self.token_count == 0:
+            return
+        filename = os.path.join(self.out_dir, f"{self.prefix}_{len(self.shards):06d}{SHARD_EXT}")
+        doc_starts = np.concatenate(self.doc_starts) if self.doc_starts else np.empty(0, dtype=np.int64)
+        write_shard(filename, self.buf[:self.token_count], self.vocab_size, self.eot, self.model_hash, doc_starts,
+                    codec=self.codec, transform=self.transform)
+        self.shards.append((os.path.basename(filename), self.token_count))
+        self.token_count = 0
+        self.doc_starts = []
+        self.progress_bar = None
+
+    def close(self):
+        # write any remaining tokens as the last shard
+        self.flush()
+
+def read_manifest(out_dir):
+    path = os.path.join(out_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def plan_chunks(file_path, chunk_bytes, out_dir, model_hash, shard_size, codec=None, transform=None):
+    # splits the input into chunks and looks up every chunk in the manifest of the last run.
+    # a chunk with the same content hash, tokenized with the same tokenizer into shards of the
+    # same size and encoding, keeps its shards. returns the parts of the input in order (shards is
+    # None where there is work to do) and the (index, start, end) of the chunks that have to be tokenized
+    previous = read_manifest(out_dir)
+    known = {}
+    settings = {'model_hash': model_hash.hex(), 'shard_size': shard_size, 'codec': codec, 'transform': transform}
+    if previous is not None and all(previous.get(key) == value for key, value in settings.items()):
+        shard_tokens = {shard['file']: shard['num_tokens'] for shard in previous['shards']}
+        for chunk in previous.get('chunks', []):
+            if chunk['sha256'] is not None:
+                known[chunk['sha256']] = [(name, shard_tokens[name]) for name in chunk['shards']]
+    parts, todo = [], []
+    for i, (start, end) in enumerate(chunk_ranges(file_path, chunk_bytes)):
+        sha256 = range_hash(file_path, start, end)
+        shards = known.pop(sha256, None)
+        parts.append({'start': start, 'end': end, 'sha256': sha256, 'shards': shards})
+        if shards is None:
+            todo.append((i, start, end))
+    return parts, todo
+
+def move_shard(out_dir, name, new_name):
+    # renames a shard together with its .idx sidecar (shards of older runs may not have one)
+    os.replace(os.path.join(out_dir, name), os.path.join(out_dir, new_name))
+    if os.path.exists(index_path(os.path.join(out_dir, name))):
+        os.replace(index_path(os.path.join(out_dir, name)), index_path(os.path.join(out_dir, new_name)))
+
+def finalize_shards(out_dir, parts, num_val_shards, manifest):
+    # parts are the outputs of the writers in corpus order: dicts with the byte range of
+    # input they covered (and its sha256, when known) and the shards they wrote. the shards
+    # get their global names (nepberta_{split}_{index}), the first num_val_shards going to val,
+    # and the manifest records the global order, token counts and split of every shard, and
+    # which chunk of the input every shard came from
+    previous = read_manifest(out_dir)
+    # move every shard we keep out of the way first, so renaming never clobbers a shard still in use
+    staged = []
+    for part in parts:
+        for name, num_tokens in part['shards']:
+            tmp_name = f"nepberta_tmp{len(staged):06d}{SHARD_EXT}"
+            move_shard(out_dir, name, tmp_name)
+            staged.append(tmp_name)
+    # whatever the last run wrote and is still there was not kept, e.g. the shards of a changed chunk
+    if previous is not None:
+        for shard in previous['shards']:
+            for path in [os.path.join(out_dir, shard['file']), index_path(os.path.join(out_dir, shard['file']))]:
+                if os.path.exists(path):
+                    os.remove(path)
+    shards, chunks = [], []
+    for part_index, part in enumerate(parts):
+        chunk = {'start': part['start'], 'end': part['end'], 'sha256': part.get('sha256'), 'shards': []}
+        for name, num_tokens in part['shards']:
+            index = len(shards)
+            split = "val" if index < num_val_shards else "train"
+            final_name = f"nepberta_{split}_{index:06d}{SHARD_EXT}"
+            move_shard(out_dir, staged[index], final_name)
+            shards.append({
+                'file': final_name,
+                'split': split,
+                'num_tokens': int(num_tokens),
+                'part': part_index,
+                'source': [part['start'], part['end']],
+            })
+            chunk['shards'].append(final_name)
+        chunks.append(chunk)
+    manifest = dict(manifest, shards=shards, chunks=chunks)
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return shards
+
+def compression_report(out_dir, shards, sample_shards=4):
+    # compression ratio over all shards of a run, and decode throughput measured on the first few
+    raw_bytes = disk_bytes = 0
+    for shard in shards:
+        path = os.path.join(out_dir, shard['file'])
+        raw_bytes += shard['num_tokens'] * np.dtype(read_header(path)['dtype']).itemsize
+        disk_bytes += os.path.getsize(path)
+    t0 = time.time()
+    decoded = sum(read_shard(os.path.join(out_dir, shard['file'])).nbytes for shard in shards[:sample_shards])
+    dt = time.time() - t0
+    print(f"compression ratio {raw_bytes / max(disk_bytes, 1):.2f}x ({raw_bytes / 1e6:.1f}MB of tokens in {disk_bytes / 1e6:.1f}MB), "
+          f"decode throughput {decoded / 1e6 / max(dt, 1e-9):.1f}MB/s")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import os
+import csv
+import time
+import resource
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from sharding import Tokenizer
+
+# CONFIGURATION
+text_file = "eval_text.txt"  # or e.g. data_preparation/cleaned_text.txt
+max_bytes = None  # only benchmark the first max_bytes of text_file, None for all of it
+output_file = 'tokenizer_benchmark.csv'  # next to tokenizer_evaluation.csv
+dirs_to_search = ['bpe-token-models', 'word-token-models', 'uni-token-models']
+tiktoken_encodings = ['o200k_base']
+repeats = 3  # every measurement is repeated and the fastest run is kept
+block_lines = 1024  # lines per task for the multi-process encode
+nprocs = max(1, os.cpu_count() // 2)
+
+def load_texts():
+    with open(text_file, 'rb') as f:
+        data = f.read() if max_bytes is None else f.read(max_bytes)
+    # drop a partial last line (and a partial utf-8 character) when the slice cut one
+    if max_bytes is not None and len(data) == max_bytes:
+        data = data[:data.rfind(b"\n") + 1]
+    return [line.strip() for line in data.decode('utf-8').split("\n") if line.strip()]
+
+def best_time(fn):
+    # run fn `repeats` times, return the fastest wall time and the result of the last run
+    best = float('inf')
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+# the multi-process encode needs the tokenizer in every worker
+worker_tokenizer = None
+
+def init_worker(spec):
+    global worker_tokenizer
+    worker_tokenizer = Tokenizer(spec)
+
+def count_tokens(docs):
+    return sum(len(ids) for ids in worker_tokenizer.encode_batch(docs))
+
+def benchmark_model(spec, texts):
+    # runs in a fresh process, so that the peak RSS is that of this tokenizer alone
+    tok = Tokenizer(spec)
+    num_bytes = sum(len(text.encode('utf-8')) for text in texts)
+
+    single_s, ids = best_time(lambda: [tok.encode(text) for text in texts])
+    num_tokens = sum(len(x) for x in ids)
+    batch_s, _ = best_time(lambda: tok.encode_batch(texts))
+    decode_s, _ = best_time(lambda: [tok.decode(x) for x in ids])
+
+    blocks = [texts[i:i + block_lines] for i in range(0, len(texts), block_lines)]
+    with mp.Pool(nprocs, initializer=init_worker, initargs=(spec,)) as pool:
+        pool.map(count_tokens, blocks[:nprocs]) # warm up the workers, pool startup is not measured
+        mp_s, _ = best_time(lambda: sum(pool.map(count_tokens, blocks)))
+
+    mb = num_bytes / 1e6
+    return {
+        'vocab_size': tok.vocab_size,
+        'corpus_mb': mb,
+        'tokens': num_tokens,
+        'single_mb_s': mb / single_s, 'single_tok_s': num_tokens / single_s,
+        'batch_mb_s': mb / batch_s, 'batch_tok_s': num_tokens / batch_s,
+        'mp_mb_s': mb / mp_s, 'mp_tok_s': num_tokens / mp_s,
+        'decode_mb_s': mb / decode_s, 'decode_tok_s': num_tokens / decode_s,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, # ru_maxrss is in KB on linux
+    }
+
+def column_labels():
+    # the multi-process columns carry the process count, e.g. MP8_MB_s
+    return ['Single', 'Batch', f'MP{nprocs}', 'Decode']
+
+def run(folder, name, spec, texts):
+    try:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            m = executor.submit(benchmark_model, spec, texts).result()
+        status = 'success'
+    except Exception as e:
+        m, status = {}, f'error: {str(e)}'
+    row = {'Model_Folder': folder, 'Model_Name': name, 'Status': status}
+    row['Vocab_Size'] = m.get('vocab_size', 0)
+    row['Corpus_MB'] = round(m.get('corpus_mb', 0), 3)
+    row['Tokens'] = m.get('tokens', 0)
+    for key, label in zip(['single', 'batch', 'mp', 'decode'], column_labels()):
+        row[f'{label}_MB_s'] = round(m.get(f'{key}_mb_s', 0), 3)
+        row[f'{label}_Tok_s'] = round(m.get(f'{key}_tok_s', 0))
+    row['Peak_RSS_MB'] = round(m.get('peak_rss_mb', 0), 1)
+    print(f"{folder}/{name}: {row}")
+    return row
+
+def main():
+    texts = load_texts()
+    print(f"benchmarking on {len(texts):,} lines of {text_file} with {nprocs} processes for the multi-process encode")
+
+    # Find SentencePiece models, then the tiktoken encodings
+    results = []
+    for base_dir in dirs_to_search:
+        if os.path.exists(base_dir):
+            for file in sorted(os.listdir(base_dir)):
+                if file.endswith('.model'):
+                    results.append(run(base_dir, os.path.splitext(file)[0], os.path.join(base_dir, file), texts))
+    for encoding_name in tiktoken_encodings:
+        results.append(run('tiktoken', encoding_name, encoding_name, texts))
+
+    # Save to CSV
+    fieldnames = ['Model_Folder', 'Model_Name', 'Vocab_Size', 'Corpus_MB', 'Tokens']
+    for label in column_labels():
+        fieldnames += [f'{label}_MB_s', f'{label}_Tok_s']
+    fieldnames += ['Peak_RSS_MB', 'Status']
+    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(results)
+
+    print(f"Results saved to {output_file}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import json
+import math
+import time
+import random
+from itertools import islice, count
+from trainer_defaults import TRAINER_DEFAULTS
+
+# -----------------------------------------------------------------------------
+# one reservoir sample of the cleaned corpus for every tokenizer training
+#
+# SentencePieceTrainer re-reads the whole corpus to sample input_sentence_size sentences on every
+# train call. this samples it once, with a fixed seed, into a small file that the trainings read
+# instead. the sample is cached: a .json sidecar records the source file and the settings, and the
+# corpus is only scanned again when one of them changes
+
+input_file = r"/home/basanta/BPE/data_preparation/cleaned_text.txt"
+output_file = r"/home/basanta/BPE/data_preparation/tokenizer_sample.txt"
+max_sentences = 8000000  # the largest input_sentence_size of the trainings that read the sample
+max_sentence_length = TRAINER_DEFAULTS["max_sentence_length"]  # longer lines are skipped, as SentencePieceTrainer does
+seed = 1337
+
+def file_identity(path):
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "size": st.st_size, "mtime": int(st.st_mtime)}
+
+def usable_lines(f):
+    # the lines SentencePieceTrainer would keep: not blank, and at most max_sentence_length bytes
+    for line in f:
+        line = line.rstrip(b"\r\n")
+        if line.strip() and len(line) <= max_sentence_length:
+            yield line
+
+def reservoir_sample(lines, k, rng):
+    # Algorithm L: a uniform sample of k lines in one pass, drawing random numbers only for the
+    # lines that enter the reservoir instead of for every line. returns (index, line) pairs and the line count
+    counter = count()
+    items = zip(counter, lines)
+    reservoir = list(islice(items, k))
+    if len(reservoir) == k:
+        w = math.exp(math.log(rng.random()) / k)
+        while True:
+            skip = int(math.log(rng.random()) / math.log(1 - w))
+            item = next(islice(items, skip, None), None)
+            if item is None:
+                break
+            reservoir[rng.randrange(k)] = item
+            w *= math.exp(math.log(rng.random()) / k)
+    # zip takes the next index before it finds the lines exhausted, so the counter is one past the last line
+    return reservoir, next(counter) - 1
+
+def sample_corpus(input_file=input_file, output_file=output_file, max_sentences=max_sentences, seed=seed):
+    # writes the sample (in corpus order) unless the cached one was made from the same input and settings
+    meta_file = output_file + ".json"
+    settings = {"input": file_identity(input_file), "max_sentences": max_sentences,
+                "max_sentence_length": max_sentence_length, "seed": seed}
+    if os.path.exists(output_file) and os.path.exists(meta_file):
+        with open(meta_file, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("settings") == settings:
+            print(f"using the cached sample {output_file} ({meta['lines_sampled']:,} of {meta['lines_seen']:,} lines)")
+            return meta
+    t0 = time.time()
+    with open(input_file, "rb") as f:
+        reservoir, lines_seen = reservoir_sample(usable_lines(f), max_sentences, random.Random(seed))
+    reservoir.sort()
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        for _, line in reservoir:
+            f.write(line + b"\n")
+    os.replace(tmp_file, output_file)
+    meta = {"settings": settings, "lines_seen": lines_seen, "lines_sampled": len(reservoir),
+            "bytes": os.path.getsize(output_file), "seconds": time.time() - t0}
+    with open(meta_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    print(f"sampled {len(reservoir):,} of {lines_seen:,} lines ({meta['bytes'] / 1e6:.1f} MB) "
+          f"to {output_file} in {meta['seconds']:.1f}s")
+    return meta
+
+if __name__ == "__main__":
+    sample_corpus()
@@ -0,0 +1,173 @@
+import os
+import csv
+import json
+import time
+import queue
+import hashlib
+import resource
+import multiprocessing as mp
+import sentencepiece as spm
+from sampling import sample_corpus, file_identity
+from word_counts import count_words
+from trainer_defaults import TRAINER_DEFAULTS
+
+# trains the whole (model_type, vocab_size) grid of tokenizers, the nine scripts next to this one,
+# as concurrent jobs within a core and RAM budget. a job is skipped when its output .model was
+# trained from the same config (and the same input file), and every job's wall time and peak
+# memory are logged to sweep_log. with sample_file set, the corpus is reservoir sampled once
+# (see sampling.py) and every job trains from the sample instead of scanning the whole corpus. with
+# word_counts_file set, every job trains from the word counts of the whole corpus instead (see word_counts.py)
+
+# CONFIGURATION
+input_file = r"/home/basanta/BPE/data_preparation/cleaned_text.txt"
+model_types = ["bpe", "unigram", "word"]
+vocab_sizes = [16384, 32768, 50256]
+input_sentence_size = {"bpe": 8000000, "unigram": 4000000, "word": 8000000}
+sample_file = r"/home/basanta/BPE/data_preparation/tokenizer_sample.txt"  # None to train every job on input_file itself
+word_counts_file = None  # e.g. r"/home/basanta/BPE/data_preparation/word_counts.tsv", to train from word counts instead of sentences
+output_dirs = {"bpe": "bpe-token-models", "unigram": "uni-token-models", "word": "word-token-models"}
+prefixes = {"bpe": "bpe", "unigram": "uni", "word": "word"}  # bpe-16, uni-32, word-50, ...
+total_cores = os.cpu_count()
+total_ram_gb = None  # None for 80% of the machine's memory
+ram_per_job_gb = {"bpe": 32, "unigram": 24, "word": 16}  # first guesses, replaced by the measured peak of finished jobs
+min_threads = 4  # no job runs with fewer threads than this (unless the machine has fewer cores)
+sweep_log = "tokenizer_sweep.csv"
+
+def machine_ram_gb():
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1]) / 1024**2
+    return 16
+
+def make_jobs(training_file, input_format=""):
+    jobs = []
+    for model_type in model_types:
+        for vocab_size in vocab_sizes:
+            model_prefix = os.path.join(output_dirs[model_type], f"{prefixes[model_type]}-{vocab_size // 1000}")
+            config = dict(TRAINER_DEFAULTS, input=training_file, model_type=model_type, vocab_size=vocab_size,
+                          input_sentence_size=input_sentence_size[model_type])
+            if input_format == "tsv":
+                # every line is a distinct word, sampling them would drop words rather than sentences
+                config.update(input_format="tsv", input_sentence_size=0)
+            # num_threads and model_prefix do not change the model, so they are not hashed. the input is
+            # hashed by its identity: a re-cleaned corpus (or a new sample) has to retrain every tokenizer
+            config_hash = hashlib.sha256(json.dumps(dict(config, input=file_identity(training_file)),
+                                                    sort_keys=True).encode("utf-8")).hexdigest()
+            jobs.append({"model_prefix": model_prefix, "config": config, "config_hash": config_hash})
+    return jobs
+
+def is_trained(job):
+    # the .model exists and the config it was trained with hashes the same
+    config_file = job["model_prefix"] + ".config.json"
+    if not os.path.exists(job["model_prefix"] + ".model") or not os.path.exists(config_file):
+        return False
+    with open(config_file, encoding="utf-8") as f:
+        return json.load(f).get("config_hash") == job["config_hash"]
+
+def train_job(job, num_threads, results):
+    # runs in its own process, so ru_maxrss is the peak memory of this training alone
+    t0 = time.time()
+    try:
+        os.makedirs(os.path.dirname(job["model_prefix"]) or ".", exist_ok=True)
+        spm.SentencePieceTrainer.train(model_prefix=job["model_prefix"], num_threads=num_threads, **job["config"])
+        with open(job["model_prefix"] + ".config.json", "w", encoding="utf-8") as f:
+            json.dump({"config_hash": job["config_hash"], "config": job["config"]}, f, indent=2)
+        status = "success"
+    except Exception as e:
+        status = f"error: {str(e)}"
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on linux
+    results.put((job["model_prefix"], time.time() - t0, peak_rss_mb, status))
+
+def main():
+    ram_budget = total_ram_gb if total_ram_gb is not None else 0.8 * machine_ram_gb()
+    training_file, input_format = input_file, ""
+    if word_counts_file is not None:
+        count_words(input_file, word_counts_file)
+        training_file, input_format = word_counts_file, "tsv"
+    elif sample_file is not None:
+        # sampled with the largest cap, jobs with a smaller input_sentence_size sample the sample
+        sample_corpus(input_file, sample_file, max(input_sentence_size[m] for m in model_types))
+        training_file = sample_file
+    jobs = make_jobs(training_file, input_format)
+    pending = [job for job in jobs if not is_trained(job)]
+    for job in jobs:
+        if job not in pending:
+            print(f"skipping {job['model_prefix']}, already trained with this config")
+    # as many jobs at once as the cores allow with min_threads each, every one gets an equal share of the cores
+    max_concurrent = max(1, min(len(pending), total_cores // min_threads)) if pending else 0
+    threads_per_job = max(1, total_cores // max(max_concurrent, 1))
+    ram_estimate = dict(ram_per_job_gb)
+    print(f"{len(pending)} of {len(jobs)} jobs to train, up to {max_concurrent} at once with {threads_per_job} threads, "
+          f"{ram_budget:.0f}GB of RAM")
+
+    results = mp.Queue()
+    running = {}  # model_prefix -> (process, job, RAM reserved)
+    rows = []
+    while pending or running:
+        # start every pending job that fits in the free cores and RAM, in grid order
+        free_ram = ram_budget - sum(reserved for _, _, reserved in running.values())
+        for job in list(pending):
+            need = ram_estimate[job["config"]["model_type"]]
+            # a job that needs more than the whole budget still runs, alone
+            if len(running) < max_concurrent and (need <= free_ram or not running):
+                p = mp.Process(target=train_job, args=(job, threads_per_job, results))
+                p.start()
+                running[job["model_prefix"]] = (p, job, need)
+                pending.remove(job)
+                free_ram -= need
+                print(f"started {job['model_prefix']} ({job['config']['model_type']}, vocab {job['config']['vocab_size']}, "
+                      f"{threads_per_job} threads, ~{need:.0f}GB)")
+        try:
+            reports = [results.get(timeout=5)]
+        except queue.Empty:
+            reports = []
+        # a job that died without reporting (e.g. killed by the OOM killer) frees its slot too. the dead
+        # are listed before the queue is drained, so a job that reported and then exited is not taken for one
+        dead = [model_prefix for model_prefix, (p, _, _) in running.items() if not p.is_alive()]
+        while True:
+            try:
+                reports.append(results.get_nowait())
+            except queue.Empty:
+                break
+        for model_prefix, wall_time, peak_rss_mb, status in reports:
+            entry = running.pop(model_prefix, None)
+            if entry is None:  # the late report of a job already reaped
+                continue
+            p, job, _ = entry
+            p.join()
+            rows.append((job, threads_per_job, wall_time, peak_rss_mb, status))
+            model_type = job["config"]["model_type"]
+            if status == "success":
+                # later jobs of this model type reserve what this one actually used, plus a margin for their larger vocabs
+                ram_estimate[model_type] = peak_rss_mb / 1024 * 1.25
+            print(f"{model_prefix}: {status} in {wall_time / 60:.1f} min, peak {peak_rss_mb / 1024:.1f}GB")
+        for model_prefix in dead:
+            if model_prefix in running:
+                p, job, _ = running.pop(model_prefix)
+                p.join()
+                rows.append((job, threads_per_job, 0.0, 0.0, f"error: exit code {p.exitcode}"))
+                print(f"{model_prefix}: error, exit code {p.exitcode}")
+
+    # Save to CSV, appending to the log of earlier sweeps
+    fieldnames = ["Model_Prefix", "Model_Type", "Vocab_Size", "Num_Threads", "Wall_Time_s", "Peak_RSS_MB", "Config_Hash", "Status"]
+    new_file = not os.path.exists(sweep_log)
+    with open(sweep_log, "a", newline="", encoding="utf-8") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        if new_file:
+            writer.writeheader()
+        for job, num_threads, wall_time, peak_rss_mb, status in rows:
+            writer.writerow({
+                "Model_Prefix": job["model_prefix"],
+                "Model_Type": job["config"]["model_type"],
+                "Vocab_Size": job["config"]["vocab_size"],
+                "Num_Threads": num_threads,
+                "Wall_Time_s": round(wall_time, 1),
+                "Peak_RSS_MB": round(peak_rss_mb, 1),
+                "Config_Hash": job["config_hash"],
+                "Status": status,
+            })
+    print(f"Results saved to {sweep_log}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+# the SentencePieceTrainer settings every tokenizer of this project was trained with, shared by
+# train-sweep.py and word-count-compare.py so that the comparison trains exactly what the sweep does
+TRAINER_DEFAULTS = dict(
+    character_coverage=0.9995,
+    shuffle_input_sentence=True,
+    train_extremely_large_corpus=True,
+    max_sentence_length=8192,
+    bos_id=1,
+    eos_id=2,
+    unk_id=0,
+    pad_id=3,
+)
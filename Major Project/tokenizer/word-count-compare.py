@@ -0,0 +1,90 @@
+import os
+import csv
+import time
+import resource
+from concurrent.futures import ProcessPoolExecutor
+import sentencepiece as spm
+from word_counts import count_words
+from trainer_defaults import TRAINER_DEFAULTS
+
+# trains every (model_type, vocab_size) tokenizer twice, once from raw sentences and once from the
+# word counts of word_counts.py (input_format='tsv'), and reports the training time and peak memory
+# of both, how much of their vocabularies they share, and their tokens per word on eval_text.txt
+
+# CONFIGURATION
+input_file = r"/home/basanta/BPE/data_preparation/cleaned_text.txt"
+word_counts_file = r"/home/basanta/BPE/data_preparation/word_counts.tsv"
+eval_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "eval_text.txt")
+model_types = ["bpe", "unigram", "word"]
+vocab_sizes = [16384, 32768, 50256]
+input_sentence_size = {"bpe": 8000000, "unigram": 4000000, "word": 8000000}  # of the raw trainings
+output_dir = "word-count-compare"  # raw/ and tsv/ models are written here
+output_file = "word_count_comparison.csv"
+num_threads = os.cpu_count()
+
+def train(model_prefix, **kwargs):
+    # runs in a fresh process, so that the peak RSS is that of this training alone
+    t0 = time.time()
+    spm.SentencePieceTrainer.train(model_prefix=model_prefix, num_threads=num_threads, **TRAINER_DEFAULTS, **kwargs)
+    return time.time() - t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # ru_maxrss is in KB on linux
+
+def run(model_prefix, **kwargs):
+    os.makedirs(os.path.dirname(model_prefix), exist_ok=True)
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(train, model_prefix, **kwargs).result()
+
+def tokens_per_word(sp, texts):
+    words = sum(len(text.split()) for text in texts)
+    return sum(len(ids) for ids in sp.encode(texts)) / max(words, 1)
+
+def main():
+    meta = count_words(input_file, word_counts_file)
+    with open(eval_file, encoding="utf-8") as f:
+        eval_texts = [line.strip() for line in f if line.strip()]
+
+    rows = []
+    for model_type in model_types:
+        for vocab_size in vocab_sizes:
+            name = f"{model_type}-{vocab_size}"
+            raw_prefix = os.path.join(output_dir, "raw", name)
+            tsv_prefix = os.path.join(output_dir, "tsv", name)
+            try:
+                raw_time, raw_rss = run(raw_prefix, input=input_file, model_type=model_type, vocab_size=vocab_size,
+                                        input_sentence_size=input_sentence_size[model_type])
+                # every tsv line is a distinct word, so none of them is sampled away
+                tsv_time, tsv_rss = run(tsv_prefix, input=word_counts_file, input_format="tsv", model_type=model_type,
+                                        vocab_size=vocab_size, input_sentence_size=0)
+                raw_sp = spm.SentencePieceProcessor(model_file=raw_prefix + ".model")
+                tsv_sp = spm.SentencePieceProcessor(model_file=tsv_prefix + ".model")
+                raw_vocab = {raw_sp.id_to_piece(i) for i in range(raw_sp.get_piece_size())}
+                tsv_vocab = {tsv_sp.id_to_piece(i) for i in range(tsv_sp.get_piece_size())}
+                row = {
+                    "Raw_Time_s": round(raw_time, 1),
+                    "TSV_Time_s": round(tsv_time, 1),
+                    "Speedup": round(raw_time / max(tsv_time, 1e-9), 2),
+                    "Raw_Peak_RSS_MB": round(raw_rss, 1),
+                    "TSV_Peak_RSS_MB": round(tsv_rss, 1),
+                    "Vocab_Overlap": round(len(raw_vocab & tsv_vocab) / max(len(raw_vocab), 1), 4),
+                    "Raw_Token_Word_Ratio": round(tokens_per_word(raw_sp, eval_texts), 4),
+                    "TSV_Token_Word_Ratio": round(tokens_per_word(tsv_sp, eval_texts), 4),
+                    "Status": "success",
+                }
+            except Exception as e:
+                row = {"Status": f"error: {str(e)}"}
+            rows.append(dict(row, Model_Type=model_type, Vocab_Size=vocab_size))
+            print(f"{name}: {row['Status']}" + (f", raw {row['Raw_Time_s']}s / {row['Raw_Peak_RSS_MB']:.0f}MB, "
+                  f"tsv {row['TSV_Time_s']}s / {row['TSV_Peak_RSS_MB']:.0f}MB, {row['Vocab_Overlap']:.1%} of the vocab shared"
+                  if row["Status"] == "success" else ""))
+
+    # Save to CSV
+    fieldnames = ["Model_Type", "Vocab_Size", "Raw_Time_s", "TSV_Time_s", "Speedup", "Raw_Peak_RSS_MB", "TSV_Peak_RSS_MB",
+                  "Vocab_Overlap", "Raw_Token_Word_Ratio", "TSV_Token_Word_Ratio", "Status"]
+    with open(output_file, "w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"word counts: {meta['unique_words']:,} unique of {meta['words']:,} words, counted in {meta['seconds']:.1f}s")
+    print(f"Results saved to {output_file}")
+
+if __name__ == "__main__":
+    main()
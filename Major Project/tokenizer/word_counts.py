@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import time
+import multiprocessing as mp
+from collections import Counter
+from sampling import file_identity
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # for the data_preparation package and sharding.py
+from data_preparation.cleaning import read_blocks
+from sharding import imap_unordered_bounded
+
+# -----------------------------------------------------------------------------
+# whitespace-word frequency counts of the cleaned corpus, as a SentencePiece tsv input
+#
+# with split_by_whitespace (the default) the trainers only ever look at whitespace-delimited words,
+# and the news corpus repeats the same words over and over. a `word\tcount` file with
+# input_format='tsv' gives them the counts of every word of the whole corpus in a fraction of the
+# lines. the counts are a map-reduce over blocks of lines: every pool worker counts a block, the main
+# process merges the counts. like the sample of sampling.py, the file is cached with a .json sidecar
+
+input_file = r"/home/basanta/BPE/data_preparation/cleaned_text.txt"
+output_file = r"/home/basanta/BPE/data_preparation/word_counts.tsv"
+min_count = 1  # rarer words are left out of the tsv
+block_lines = 1 << 16  # lines counted at once by a worker
+nprocs = max(1, mp.cpu_count() - 1)
+max_pending = 4 * nprocs  # blocks read ahead of the merge
+
+def count_block(lines):
+    # runs in a pool worker. bytes.split() splits on ascii whitespace, which is all the whitespace
+    # clean_non_devanagari leaves, and never decodes a line
+    counts = Counter()
+    for line in lines:
+        counts.update(line.split())
+    return counts
+
+def count_words(input_file=input_file, output_file=output_file, min_count=min_count):
+    # writes the tsv (most frequent words first) unless the cached one was made from the same input and settings
+    meta_file = output_file + ".json"
+    settings = {"input": file_identity(input_file), "min_count": min_count}
+    if os.path.exists(output_file) and os.path.exists(meta_file):
+        with open(meta_file, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("settings") == settings:
+            print(f"using the cached word counts {output_file} ({meta['unique_words']:,} of {meta['words']:,} words)")
+            return meta
+    t0 = time.time()
+    counts = Counter()
+    with open(input_file, "rb") as infile, mp.Pool(nprocs) as pool:
+        for block_counts in imap_unordered_bounded(pool, count_block, read_blocks(infile, block_lines), max_pending):
+            counts.update(block_counts)
+    tmp_file = output_file + ".tmp"
+    unique_words = 0
+    with open(tmp_file, "wb") as f:
+        # words with equal counts are sorted by their bytes, so the file does not depend on the order the blocks were merged in
+        for word, count in sorted(counts.items(), key=lambda item: (-item[1], item[0])):
+            if count < min_count:
+                break
+            f.write(b"%s\t%d\n" % (word, count))
+            unique_words += 1
+    os.replace(tmp_file, output_file)
+    meta = {"settings": settings, "words": sum(counts.values()), "unique_words": unique_words,
+            "bytes": os.path.getsize(output_file), "seconds": time.time() - t0}
+    with open(meta_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    print(f"counted {meta['words']:,} words, {unique_words:,} unique ({meta['bytes'] / 1e6:.1f} MB) "
+          f"to {output_file} in {meta['seconds']:.1f}s")
+    return meta
+
+if __name__ == "__main__":
+    count_words()
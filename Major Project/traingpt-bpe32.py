@@ -8,9 +8,28 @@ import torch.nn as nn
 from torch.nn import functional as F
 import sentencepiece as spm
 import csv
+import argparse
 # from hellaswag import render_example, iterate_examples
+try:
+    from torch.nn.attention.flex_attention import flex_attention, create_block_mask
+    flex_attention = torch.compile(flex_attention) # flex attention is only fast once compiled
+except ImportError:
+    flex_attention = None
 # -----------------------------------------------------------------------------
 
+def document_mask(doc_ids):
+    # block-diagonal causal mask for packed sequences: a token only attends to the earlier
+    # tokens of its own document. doc_ids is (B, T), one document number per token
+    B, T = doc_ids.size()
+    if flex_attention is not None and doc_ids.is_cuda:
+        def mask_mod(b, h, q_idx, kv_idx):
+            return (doc_ids[b, q_idx] == doc_ids[b, kv_idx]) & (q_idx >= kv_idx)
+        # flex attention skips the blocks that are entirely cross-document, so they cost no FLOPs
+        return create_block_mask(mask_mod, B, None, T, T, device=doc_ids.device)
+    causal = torch.ones(T, T, dtype=torch.bool, device=doc_ids.device).tril()
+    return ((doc_ids[:, :, None] == doc_ids[:, None, :]) & causal).unsqueeze(1) # (B, 1, T, T)
+
+
 class CausalSelfAttention(nn.Module):
 
     def __init__(self, config):
@@ -25,7 +44,7 @@ class CausalSelfAttention(nn.Module):
         self.n_head = config.n_head
         self.n_embd = config.n_embd
 
-    def forward(self, x):
+    def forward(self, x, attn_mask=None):
         B, T, C = x.size() # batch size, sequence length, embedding dimensionality (n_embd)
         # calculate query, key, values for all heads in batch and move head forward to be the batch dim
         # nh is "number of heads", hs is "head size", and C (number of channels) = nh * hs
@@ -35,7 +54,12 @@ class CausalSelfAttention(nn.Module):
         k = k.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
         q = q.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
         v = v.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
-        y = F.scaled_dot_product_attention(q, k, v, is_causal=True) # flash attention
+        if attn_mask is None:
+            y = F.scaled_dot_product_attention(q, k, v, is_causal=True) # flash attention
+        elif isinstance(attn_mask, torch.Tensor):
+            y = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask) # document mask, dense
+        else:
+            y = flex_attention(q, k, v, block_mask=attn_mask) # document mask, block sparse
         y = y.transpose(1, 2).contiguous().view(B, T, C) # re-assemble all head outputs side by side
         # output projection
         y = self.c_proj(y)
@@ -65,8 +89,8 @@ class Block(nn.Module):
         self.ln_2 = nn.LayerNorm(config.n_embd)
         self.mlp = MLP(config)
 
-    def forward(self, x):
-        x = x + self.attn(self.ln_1(x))
+    def forward(self, x, attn_mask=None):
+        x = x + self.attn(self.ln_1(x), attn_mask)
         x = x + self.mlp(self.ln_2(x))
         return x
 
@@ -110,18 +134,23 @@ class GPT(nn.Module):
         elif isinstance(module, nn.Embedding):
             torch.nn.init.normal_(module.weight, mean=0.0, std=0.02)
 
-    def forward(self, idx, targets=None):
+    def forward(self, idx, targets=None, doc_ids=None, pos=None):
         # idx is of shape (B, T)
+        # for packed sequences, doc_ids (B, T) numbers the documents of each row and pos (B, T)
+        # restarts at every document, so attention and positions never cross a document boundary
         B, T = idx.size()
         assert T <= self.config.block_size, f"Cannot forward sequence of length {T}, block size is only {self.config.block_size}"
         # forward the token and posisition embeddings
-        pos = torch.arange(0, T, dtype=torch.long, device=idx.device) # shape (T)
-        pos_emb = self.transformer.wpe(pos) # position embeddings of shape (T, n_embd)
+        if pos is None:
+            pos = torch.arange(0, T, dtype=torch.long, device=idx.device) # shape (T)
+        pos_emb = self.transformer.wpe(pos) # position embeddings of shape (T, n_embd) or (B, T, n_embd)
         tok_emb = self.transformer.wte(idx) # token embeddings of shape (B, T, n_embd)
         x = tok_emb + pos_emb
+        # the document mask is the same for every layer, so build it once
+        attn_mask = document_mask(doc_ids) if doc_ids is not None else None
         # forward the blocks of the transformer
         for block in self.transformer.h:
-            x = block(x)
+            x = block(x, attn_mask)
         # forward the final layernorm and the classifier
         x = self.transformer.ln_f(x)
         logits = self.lm_head(x) # (B, T, vocab_size)
@@ -206,53 +235,9 @@ class GPT(nn.Module):
 
 # -----------------------------------------------------------------------------
 # import tiktoken
-import numpy as np
-
-def load_tokens(filename):
-    npt = np.load(filename)
-    npt = npt.astype(np.int32) # added after video
-    ptt = torch.tensor(npt, dtype=torch.long)
-    return ptt
-
-class DataLoaderLite:
-    def __init__(self, B, T, process_rank, num_processes, split):
-        self.B = B
-        self.T = T
-        self.process_rank = process_rank
-        self.num_processes = num_processes
-        assert split in {'train', 'val'}
-
-        # get the shard filenames
-        data_root = "shards-bpe-32"
-        shards = os.listdir(data_root)
-        shards = [s for s in shards if split in s]
-        shards = sorted(shards)
-        shards = [os.path.join(data_root, s) for s in shards]
-        self.shards = shards
-        assert len(shards) > 0, f"no shards found for split {split}"
-        if master_process:
-            print(f"found {len(shards)} shards for split {split}")
-        self.reset()
-
-    def reset(self):
-        # state, init at shard zero
-        self.current_shard = 0
-        self.tokens = load_tokens(self.shards[self.current_shard])
-        self.current_position = self.B * self.T * self.process_rank
-
-    def next_batch(self):
-        B, T = self.B, self.T
-        buf = self.tokens[self.current_position : self.current_position+B*T+1]
-        x = (buf[:-1]).view(B, T) # inputs
-        y = (buf[1:]).view(B, T) # targets
-        # advance the position in the tensor
-        self.current_position += B * T * self.num_processes
-        # if loading the next batch would be out of bounds, advance to next shard
-        if self.current_position + (B * T * self.num_processes + 1) > len(self.tokens):
-            self.current_shard = (self.current_shard + 1) % len(self.shards)
-            self.tokens = load_tokens(self.shards[self.current_shard])
-            self.current_position = B * T * self.process_rank
-        return x, y
+from dataloader import DataLoaderLite, ShuffledDataLoader, ShardDataset, WorkerDataLoader, PrefetchDataLoader
+from dataloader import stage_batches, document_ids
+from shard_format import tokenizer_hash
 
 # -----------------------------------------------------------------------------
 
@@ -303,7 +288,9 @@ if torch.cuda.is_available():
 
 # enc = tiktoken.get_encoding("o200k_base")
 sp = spm.SentencePieceProcessor()
-sp.load(r"/home/basanta/BPE/bpe-token-models/bpe-32.model")  
+tokenizer_model = r"/home/basanta/BPE/bpe-token-models/bpe-32.model"
+sp.load(tokenizer_model)
+eot = sp.piece_to_id("</s>") if sp.piece_to_id("</s>") != 0 else sp.piece_to_id("<unk>") # the token shard-gen.py puts at the start of every document
 
 total_batch_size = 524288 # 2**19, ~0.5M, in number of tokens
 B = 4 # micro batch size
@@ -314,8 +301,31 @@ if master_process:
     print(f"total desired batch size: {total_batch_size}")
     print(f"=> calculated gradient accumulation steps: {grad_accum_steps}")
 
-train_loader = DataLoaderLite(B=B, T=T, process_rank=ddp_rank, num_processes=ddp_world_size, split="train")
-val_loader = DataLoaderLite(B=B, T=T, process_rank=ddp_rank, num_processes=ddp_world_size, split="val")
+model_hash = tokenizer_hash(tokenizer_model) # shards written by another tokenizer are refused
+data_root = "shards-bpe-32"
+use_mmap = True # memory-map the shards and widen only each B*T+1 batch, instead of copying whole shards to int64
+use_shuffle = False # sample T+1 token windows from all train shards in a seeded, per-epoch random order
+use_workers = False # stream the train shards through a multi-worker torch DataLoader, shards split over ranks and workers
+num_workers = 4 # DataLoader worker processes per rank, when use_workers is set
+if use_shuffle:
+    train_loader = ShuffledDataLoader(B=B, T=T, process_rank=ddp_rank, num_processes=ddp_world_size, split="train", data_root=data_root, seed=1337, master_process=master_process, vocab_size=32768, model_hash=model_hash)
+elif use_workers:
+    train_dataset = ShardDataset(B=B, T=T, process_rank=ddp_rank, num_processes=ddp_world_size, split="train", data_root=data_root, master_process=master_process, vocab_size=32768, model_hash=model_hash)
+    train_loader = WorkerDataLoader(train_dataset, num_workers=num_workers)
+else:
+    train_loader = DataLoaderLite(B=B, T=T, process_rank=ddp_rank, num_processes=ddp_world_size, split="train", data_root=data_root, use_mmap=use_mmap, master_process=master_process, vocab_size=32768, model_hash=model_hash)
+val_loader = DataLoaderLite(B=B, T=T, process_rank=ddp_rank, num_processes=ddp_world_size, split="val", data_root=data_root, use_mmap=use_mmap, master_process=master_process, vocab_size=32768, model_hash=model_hash)
+# the validation windows are fixed, so read them once and keep them resident instead of reloading every eval
+val_tokens = 81920 # number of validation tokens per evaluation, across all ranks
+val_loss_steps = val_tokens // (B * T * ddp_world_size)
+assert val_loss_steps > 0, "val_tokens must cover at least one micro batch per rank"
+val_device = device # "cpu" keeps the staged batches in pinned host memory instead of on the GPU
+val_x, val_y = stage_batches(val_loader, val_loss_steps, val_device)
+use_packed = False # treat EOT-packed windows as separate documents: block-diagonal attention, positions restart per document
+use_prefetch = False # read ahead (including shard switches) in a background thread into pinned buffers
+prefetch_batches = 8 # how many micro batches the background thread may run ahead
+if use_prefetch:
+    train_loader = PrefetchDataLoader(train_loader, prefetch=prefetch_batches)
 
 torch.set_float32_matmul_precision('high')
 
@@ -353,17 +363,55 @@ optimizer = raw_model.configure_optimizers(weight_decay=0.1, learning_rate=6e-4,
 log_dir = "bpe32-models"
 os.makedirs(log_dir, exist_ok=True)
 log_file = os.path.join(log_dir, f"log.txt")
-with open(log_file, "w") as f: # open for writing to clear the file
-    pass
+
+# optionally resume: `--resume` picks the latest checkpoint in log_dir, `--resume PATH` a specific one
+parser = argparse.ArgumentParser()
+parser.add_argument("--resume", nargs="?", const="latest", default=None, help="checkpoint to resume training from")
+args = parser.parse_args()
+start_step = 0
+if args.resume is not None:
+    resume_path = args.resume
+    if resume_path == "latest":
+        checkpoints = sorted(f for f in os.listdir(log_dir) if f.startswith("model_") and f.endswith(".pt"))
+        assert len(checkpoints) > 0, f"no checkpoints to resume from in {log_dir}"
+        resume_path = os.path.join(log_dir, checkpoints[-1])
+    checkpoint = torch.load(resume_path, map_location="cpu", weights_only=False)
+    assert 'train_loader' in checkpoint, f"{resume_path} has no data loader state, so it cannot be resumed exactly"
+    raw_model.load_state_dict(checkpoint['model'])
+    optimizer.load_state_dict(checkpoint['optimizer'])
+    # seek the loader straight to where the checkpoint was taken, no batches are replayed
+    train_loader.load_state_dict(checkpoint['train_loader'])
+    torch.set_rng_state(checkpoint['rng_state'])
+    if torch.cuda.is_available() and 'cuda_rng_state' in checkpoint:
+        torch.cuda.set_rng_state(checkpoint['cuda_rng_state'])
+    start_step = checkpoint['step']
+    if master_process:
+        print(f"resuming from {resume_path} at step {start_step}")
+    del checkpoint
+
+if start_step == 0:
+    with open(log_file, "w") as f: # open for writing to clear the file
+        pass
 
 # Initialize CSV logging
 if master_process:  ### <-- ADDED
     log_file = "loss_log.csv"  ### <-- ADDED
-    with open(log_file, mode='w', newline='') as f:  ### <-- ADDED
-        writer = csv.writer(f)  ### <-- ADDED
-        writer.writerow(["step", "timestamp", "train_loss", "val_loss"])  ### <-- ADDED
-
-for step in range(max_steps):
+    if start_step == 0: # a resumed run appends to the existing log
+        with open(log_file, mode='w', newline='') as f:  ### <-- ADDED
+            writer = csv.writer(f)  ### <-- ADDED
+            writer.writerow(["step", "timestamp", "train_loss", "val_loss"])  ### <-- ADDED
+    else:
+        # the steps after the checkpoint are trained (and logged) again, so drop the rows the interrupted run logged for them
+        rows = [["step", "timestamp", "train_loss", "val_loss"]]
+        if os.path.exists(log_file):
+            with open(log_file, newline='') as f:
+                rows = list(csv.reader(f)) or rows
+        with open(log_file, mode='w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(rows[0])
+            writer.writerows(row for row in rows[1:] if int(row[0]) < start_step)
+
+for step in range(start_step, max_steps):
     t0 = time.time()
     last_step = (step == max_steps - 1)
     
@@ -372,15 +420,13 @@ for step in range(max_steps):
     # once in a while evaluate our validation loss
     if step % 50 == 0 or last_step:
         model.eval()
-        val_loader.reset()
         with torch.no_grad():
             val_loss_accum = 0.0
-            val_loss_steps = 20
-            for _ in range(val_loss_steps):
-                x, y = val_loader.next_batch()
-                x, y = x.to(device), y.to(device)
+            for i in range(val_loss_steps):
+                x, y = val_x[i].to(device, non_blocking=True), val_y[i].to(device, non_blocking=True)
+                doc_ids, pos = document_ids(x, eot) if use_packed else (None, None)
                 with torch.autocast(device_type=device_type, dtype=torch.bfloat16):
-                    logits, loss = model(x, y)
+                    logits, loss = model(x, y, doc_ids=doc_ids, pos=pos)
                 loss = loss / val_loss_steps
                 val_loss_accum += loss.detach()
         if ddp:
@@ -399,6 +445,7 @@ for step in range(max_steps):
                     'val_loss': val_loss_accum.item(),
                     'optimizer': optimizer.state_dict(),     # Save optimizer state
                     'rng_state': torch.get_rng_state(), 
+                    'train_loader': train_loader.state_dict(), # data loader position, for --resume
                 }
                 # you might also want to add optimizer.state_dict() and
                 # rng seeds etc., if you wanted to more exactly resume training
@@ -446,14 +493,18 @@ for step in range(max_steps):
     model.train()
     optimizer.zero_grad()
     loss_accum = 0.0
+    data_wait = 0.0 # seconds this step spent blocked waiting on the data loader
     for micro_step in range(grad_accum_steps):
+        t_data = time.time()
         x, y = train_loader.next_batch()
-        x, y = x.to(device), y.to(device)
+        data_wait += time.time() - t_data
+        x, y = x.to(device, non_blocking=True), y.to(device, non_blocking=True)
+        doc_ids, pos = document_ids(x, eot) if use_packed else (None, None)
         # added after video, this field is also used by the forward pass.
         if ddp:
             model.require_backward_grad_sync = (micro_step == grad_accum_steps - 1)
         with torch.autocast(device_type=device_type, dtype=torch.bfloat16):
-            logits, loss = model(x, y)
+            logits, loss = model(x, y, doc_ids=doc_ids, pos=pos)
         # we have to scale the loss to account for gradient accumulation,
         # because the gradients just add on each successive backward().
         # addition of gradients corresponds to a SUM in the objective, but
@@ -478,7 +529,7 @@ for step in range(max_steps):
     current_time = time.strftime("%Y-%m-%d %H:%M:%S")
     
     if master_process:
-        print(f"Current Time: {current_time} | step {step:5d} | loss: {loss_accum.item():.6f} | lr {lr:.4e} | norm: {norm:.4f} | dt: {dt*1000:.2f}ms | tok/sec: {tokens_per_sec:.2f}")
+        print(f"Current Time: {current_time} | step {step:5d} | loss: {loss_accum.item():.6f} | lr {lr:.4e} | norm: {norm:.4f} | dt: {dt*1000:.2f}ms | data wait: {data_wait*1000:.2f}ms | tok/sec: {tokens_per_sec:.2f}")
         with open(log_file, mode='a', newline='') as f:  ### <-- ADDED
             writer = csv.writer(f)  ### <-- ADDED
             writer.writerow([  ### <-- ADDED